@@ -4,68 +4,205 @@ from typing import List
 
 import polars as pl
 
+from navstore import NavStore
+from tradingcalendar import load_calendar
 
-def check_availability(
-    schemes: List[str], start_date: datetime.date, end_date: datetime.date
-):
-    """
-    Check the availability of schemes for a given date range.
-    This function should return a list of date ranges for which the schemes are not available.
+AVAILABILITY_PATH = "navavailability.parquet"
+
+
+def merge_intervals(df: pl.DataFrame | pl.LazyFrame) -> pl.LazyFrame:
     """
+    Merge overlapping or adjacent date intervals of each scheme.
 
-    date_range = pl.date_range(
-        start=start_date,
-        end=end_date,
-        interval="1d",
-        closed="both",
-        eager=True,
-    )
+    Two intervals are adjacent when there is no trading day between them, e.g. one ending on a Friday and the next
+    one starting on the following Monday, or around a holiday of the trading calendar.
+
+    Args:
+        df: Intervals with the columns 'scheme_code', 'start_date' and 'end_date' (both included).
 
-    # Filter the date range to only include business days
-    date_range = date_range.filter(date_range.dt.is_business_day()).to_frame("date")
-    print(date_range)
-
-    # Check if availability file exists
-    if pathlib.Path("navavailability.parquet").exists():
-        # If it exists, read the file and check for availability
-        df_availability = pl.read_parquet("navavailability.parquet")
-        # Check if the date range is available in the file
-        found = df_availability.join_where(
-            date_range,
-            pl.col("date")
-            >= pl.col("start_date") & pl.col("date")
-            <= pl.col("end_date"),
+    Returns:
+        pl.LazyFrame: The merged intervals, sorted by scheme code and start date.
+    """
+    holidays = load_calendar().holidays
+    return (
+        df.lazy()
+        .sort("scheme_code", "start_date")
+        .with_columns(
+            pl.col("end_date")
+            .cum_max()
+            .shift(1)
+            .over("scheme_code")
+            .alias("_previous_end")
         )
-        # Filter the date range to only include dates that are not in the availability file
-        date_range = date_range.join(found, on="date", how="anti")
-
-    # Check if NAV data file exists
-    if pathlib.Path("navdata.parquet").exists():
-        # If it exists, read the file and check for availability
-        df_navdata = pl.read_parquet("navdata.parquet").filter(
-            pl.col("scheme_code").is_in(schemes)
+        .with_columns(
+            # An interval starts a new group if at least one trading day is missing since the previous ones ended.
+            (
+                pl.business_day_count(
+                    "_previous_end", "start_date", holidays=holidays
+                )
+                > 1
+            )
+            .fill_null(True)
+            .cum_sum()
+            .over("scheme_code")
+            .alias("_group")
+        )
+        .group_by("scheme_code", "_group")
+        .agg(pl.col("start_date").min(), pl.col("end_date").max())
+        .drop("_group")
+        .sort("scheme_code", "start_date")
+    )
+
+
+def coverage_intervals(df: pl.DataFrame | pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Compute the contiguous date intervals covered by NAV data rows with the columns 'scheme_code' and 'date'.
+    """
+    return merge_intervals(
+        df.lazy()
+        .select(pl.col("scheme_code"), pl.col("date"))
+        .unique()
+        .select(
+            pl.col("scheme_code"),
+            pl.col("date").alias("start_date"),
+            pl.col("date").alias("end_date"),
         )
+    )
+
+
+def rebuild_coverage(path: str = AVAILABILITY_PATH) -> pl.DataFrame:
+    """
+    Build the coverage index again from all the data in the NAV store.
+    """
+    df = coverage_intervals(NavStore().scan()).collect()
+    df.write_parquet(path)
+    return df
+
+
+def update_coverage(df_new: pl.DataFrame | pl.LazyFrame, path: str = AVAILABILITY_PATH):
+    """
+    Add newly ingested NAV data rows to the coverage index.
+
+    Only the intervals are merged, so the cost depends on the number of intervals and new rows, not on the size of
+    the NAV history.
+    """
+    if not pathlib.Path(path).exists():
+        rebuild_coverage(path)
+        return
+    df = merge_intervals(
+        pl.concat([pl.scan_parquet(path), coverage_intervals(df_new)])
+    ).collect()
+    df.write_parquet(path)
 
-        df_schemes = pl.DataFrame({"scheme_code": schemes})
-        cross_date_range = df_schemes.join(date_range, how="cross")
-        # Filter the date range to only include dates that are not in the NAV data file
-        cross_date_range = cross_date_range.join(
-            df_navdata, on=["date", "scheme_code"], how="anti"
+
+def load_coverage(path: str = AVAILABILITY_PATH) -> pl.LazyFrame:
+    """
+    Read the coverage index, building it from the NAV store if it does not exist yet.
+    """
+    if not pathlib.Path(path).exists():
+        rebuild_coverage(path)
+    return pl.scan_parquet(path)
+
+
+def find_gaps(
+    schemes: List[str] | None,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    path: str = AVAILABILITY_PATH,
+) -> pl.DataFrame:
+    """
+    Find the ranges of trading days between start_date and end_date for which the schemes have no NAV data.
+
+    The gaps are the spaces between consecutive covered intervals of each scheme (plus before the first and after
+    the last one), so the cost depends on the number of intervals and not on the number of days.
+
+    If schemes is None, find the ranges for which no scheme at all has NAV data. The scheme code of these ranges is
+    null.
+
+    Returns:
+        pl.DataFrame: The missing ranges with the columns 'scheme_code', 'start_date' and 'end_date' (both included
+                   and trading days).
+    """
+    df_intervals = load_coverage(path)
+    if schemes is None:
+        # A day is covered if any scheme has data for it
+        df_intervals = merge_intervals(
+            df_intervals.with_columns(pl.lit(None, pl.String).alias("scheme_code"))
         )
-        date_range = cross_date_range.select(pl.col("date").unique())
-    return date_range.sort("date")
+        schemes = [None]
+    df_schemes = pl.LazyFrame({"scheme_code": schemes}, schema={"scheme_code": pl.String})
+
+    # Empty intervals just before start_date and just after end_date, so that the leading and trailing gaps are
+    # found like any other gap.
+    calendar = load_calendar()
+    before = calendar.previous_trading_day(start_date, strict=True)
+    after = calendar.next_trading_day(end_date, strict=True)
+    df_bounds = pl.concat(
+        [
+            df_schemes.with_columns(
+                start_date=pl.lit(before), end_date=pl.lit(before)
+            ),
+            df_schemes.with_columns(start_date=pl.lit(after), end_date=pl.lit(after)),
+        ]
+    )
+
+    df_intervals = df_intervals.join(
+        df_schemes, on="scheme_code", how="semi", nulls_equal=True
+    ).filter(pl.col("end_date") >= start_date, pl.col("start_date") <= end_date)
 
+    return (
+        pl.concat([df_intervals, df_bounds])
+        .sort("scheme_code", "start_date")
+        .select(
+            pl.col("scheme_code"),
+            pl.col("end_date")
+            .cum_max()
+            .shift(1)
+            .over("scheme_code")
+            .dt.add_business_days(1, roll="backward", holidays=calendar.holidays)
+            .alias("start_date"),
+            pl.col("start_date")
+            .dt.add_business_days(-1, roll="forward", holidays=calendar.holidays)
+            .alias("end_date"),
+        )
+        .filter(pl.col("start_date") <= pl.col("end_date"))
+        .collect()
+    )
 
-start_date = datetime.date(2022, 1, 1)
-end_date = datetime.date.today()
 
-date_range = check_availability(["143341", "143340"], start_date, end_date)
-df = date_range.group_by_dynamic("date", every="1w").agg(
-    [
-        pl.col("date").first().alias("start_date"),
-        pl.col("date").last().alias("end_date"),
-        pl.len().alias("count"),
+def check_availability(
+    schemes: List[str], start_date: datetime.date, end_date: datetime.date
+):
+    """
+    Check the availability of schemes for a given date range.
+    This function returns the trading days for which at least one of the schemes is not available.
+    """
+    calendar = load_calendar()
+    days = [
+        calendar.trading_days(start, end)
+        for start, end in find_gaps(schemes, start_date, end_date)
+        .select("start_date", "end_date")
+        .iter_rows()
     ]
-)
-print(df)
-print(df.mean()["count"][0])
+    return (
+        pl.concat([pl.Series("date", [], pl.Date), *days])
+        .unique()
+        .sort()
+        .to_frame()
+    )
+
+
+if __name__ == "__main__":
+    start_date = datetime.date(2022, 1, 1)
+    end_date = datetime.date.today()
+
+    date_range = check_availability(["143341", "143340"], start_date, end_date)
+    df = date_range.group_by_dynamic("date", every="1w").agg(
+        [
+            pl.col("date").first().alias("start_date"),
+            pl.col("date").last().alias("end_date"),
+            pl.len().alias("count"),
+        ]
+    )
+    print(df)
+    print(df.mean()["count"][0])
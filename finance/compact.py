@@ -0,0 +1,125 @@
+import pathlib
+
+import polars as pl
+
+SCHEME_IDS_PATH = "scheme_ids.parquet"
+
+# NAVs are published with 4 decimals, so they are stored as integer multiples of 0.0001
+NAV_SCALE = 10_000
+
+# Columns with few distinct values, stored as categoricals
+CATEGORICAL_COLUMNS = ["scheme_type", "fund_house"]
+
+SCHEME_IDS_SCHEMA = pl.Schema({"scheme_id": pl.UInt32(), "scheme_code": pl.String()})
+
+
+def nav_to_int(nav: pl.Expr) -> pl.Expr:
+    """
+    Encode NAVs as Int64 multiples of 1 / NAV_SCALE. Exact for NAVs with up to 4 decimals.
+    """
+    return (nav.cast(pl.Decimal(38, 4)) * NAV_SCALE).cast(pl.Int64)
+
+
+def nav_from_int(nav: pl.Expr) -> pl.Expr:
+    """
+    Decode NAVs encoded with nav_to_int back to Decimal(38, 4), exactly.
+    """
+    return (nav.cast(pl.Decimal(38, 4)) / NAV_SCALE).cast(pl.Decimal(38, 4))
+
+
+class SchemeIds:
+    """
+    Dense integer IDs for scheme codes, stored as a Parquet dimension table.
+
+    IDs are assigned in the order the scheme codes are first seen and never change, so data encoded with them stays
+    valid as new schemes are added.
+
+    Example:
+    >>> df_ids = SchemeIds().update(df["scheme_code"])
+    >>> df_compact = to_compact(df, df_ids)
+    """
+
+    def __init__(self, path: str | pathlib.Path = SCHEME_IDS_PATH):
+        self.path = pathlib.Path(path)
+
+    def load(self) -> pl.DataFrame:
+        if not self.path.exists():
+            return pl.DataFrame(schema=SCHEME_IDS_SCHEMA)
+        return pl.read_parquet(self.path)
+
+    def update(self, scheme_codes: pl.Series) -> pl.DataFrame:
+        """
+        Assign IDs to the scheme codes which do not have one yet.
+
+        Returns:
+            pl.DataFrame: All the IDs, with the columns 'scheme_id' and 'scheme_code'.
+        """
+        df_ids = self.load()
+        codes = scheme_codes.drop_nulls().unique(maintain_order=True)
+        new_codes = codes.filter(~codes.is_in(df_ids["scheme_code"]))
+        if new_codes.is_empty():
+            return df_ids
+
+        df_new = pl.DataFrame(
+            {
+                "scheme_id": pl.int_range(
+                    len(df_ids),
+                    len(df_ids) + len(new_codes),
+                    dtype=pl.UInt32,
+                    eager=True,
+                ),
+                "scheme_code": new_codes,
+            }
+        )
+        df_ids = pl.concat([df_ids, df_new])
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        df_ids.write_parquet(tmp_path)
+        tmp_path.replace(self.path)
+        return df_ids
+
+
+def to_compact(df: pl.DataFrame | pl.LazyFrame, df_ids: pl.DataFrame) -> pl.LazyFrame:
+    """
+    Convert NAV data or metadata to the compact representation.
+
+    'scheme_code' is replaced by the integer 'scheme_id', 'nav' becomes a scaled Int64 and the scheme type and fund
+    house become categoricals. Other columns are kept as they are, in the same order. All the scheme codes must
+    already have an ID, see SchemeIds.update, otherwise collecting the result fails.
+    """
+    df = df.lazy()
+    return df.select(
+        [
+            pl.col("scheme_code")
+            .replace_strict(df_ids["scheme_code"], df_ids["scheme_id"])
+            .alias("scheme_id")
+            if name == "scheme_code"
+            else nav_to_int(pl.col("nav"))
+            if name == "nav"
+            else pl.col(name).cast(pl.Categorical)
+            if name in CATEGORICAL_COLUMNS
+            else pl.col(name)
+            for name in df.collect_schema().names()
+        ]
+    )
+
+
+def from_compact(df: pl.DataFrame | pl.LazyFrame, df_ids: pl.DataFrame) -> pl.LazyFrame:
+    """
+    Convert data from to_compact back to scheme codes, Decimal NAVs and string columns.
+    """
+    df = df.lazy()
+    return df.select(
+        [
+            pl.col("scheme_id")
+            .replace_strict(df_ids["scheme_id"], df_ids["scheme_code"])
+            .alias("scheme_code")
+            if name == "scheme_id"
+            else nav_from_int(pl.col("nav"))
+            if name == "nav"
+            else pl.col(name).cast(pl.String)
+            if name in CATEGORICAL_COLUMNS
+            else pl.col(name)
+            for name in df.collect_schema().names()
+        ]
+    )
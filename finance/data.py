@@ -1,3 +1,102 @@
+import datetime
+from typing import Iterable
+
 import polars as pl
 
-df = pl.scan_parquet("data.parquet")
\ No newline at end of file
+from compact import SchemeIds, from_compact
+from navstore import NavStore
+from tradingcalendar import TradingCalendar, load_calendar
+
+# NAVs are carried forward over at most this many calendar days, e.g. over a long weekend or a holiday without a NAV.
+# A longer gap is left null.
+MAX_FILL_DAYS = 10
+
+
+def read_funds(path: str, scheme_ids: SchemeIds | None = None) -> pl.LazyFrame:
+    """
+    Read a file written by funds.py, with scheme codes, Decimal NAVs and string columns instead of the compact form.
+
+    scheme_ids is the dimension the file was written with, the default SchemeIds if None.
+    """
+    return from_compact(pl.scan_parquet(path), (scheme_ids or SchemeIds()).load())
+
+
+def get_nav(
+    schemes: Iterable[str] | None = None,
+    start: datetime.date | None = None,
+    end: datetime.date | None = None,
+    fill: str = "ffill",
+    calendar: TradingCalendar | None = None,
+    wide: bool = False,
+    store: NavStore | None = None,
+) -> pl.DataFrame:
+    """
+    Get the NAVs of schemes on each trading day between start and end.
+
+    The NAVs are read from the NAV store (see NavStore), which holds the history downloaded by multiples.py and the
+    daily NAVs of funds.py. data.parquet, written by funds.py, only holds the latest NAVs and is read by read_funds.
+
+    Only the partitions of the requested dates are opened, and the scheme and date filters are pushed down to the
+    Parquet scan, so reading the history of one scheme only reads the row groups containing it (see NavStore).
+
+    Example:
+    >>> get_nav(["119551", "120503"], datetime.date(2015, 1, 1), datetime.date(2024, 12, 31), wide=True)
+
+    Args:
+        schemes (Iterable[str] | None): Scheme codes. If None, all the schemes with data in the date range.
+        start (datetime.date | None): First date, included. If None, the first date with data.
+        end (datetime.date | None): Last date, included. If None, the last date with data.
+        fill (str): "ffill" to carry the last NAV forward to trading days without one (for at most MAX_FILL_DAYS days,
+                   including from before start), or "none" to leave them null.
+        calendar (TradingCalendar | None): Calendar of the trading days. If None, the calendar of holidays.csv.
+        wide (bool): Return one column of NAVs per scheme instead of one row per scheme and date.
+        store (NavStore | None): The store to read. If None, the default NavStore.
+
+    Returns:
+        pl.DataFrame: Long: the columns 'scheme_code', 'date' and 'nav', sorted by scheme code and date. Wide: a
+                   'date' column and one column per scheme code, sorted by date. Every trading day has a row for
+                   every scheme, with a null NAV when there is none.
+    """
+    if fill not in ("ffill", "none"):
+        raise ValueError(f"fill must be 'ffill' or 'none', got {fill!r}")
+    store = store or NavStore()
+    calendar = calendar or load_calendar()
+    schemes = None if schemes is None else list(schemes)
+    max_gap = datetime.timedelta(days=MAX_FILL_DAYS)
+
+    scan_start = start - max_gap if start is not None and fill == "ffill" else start
+    df = (
+        store.scan(schemes, scan_start, end)
+        .select("scheme_code", "date", "nav")
+        .collect()
+    )
+
+    if schemes is None:
+        schemes = df["scheme_code"].unique().sort().to_list()
+    if df.is_empty() and (start is None or end is None):
+        df_days = pl.Series("date", [], pl.Date)
+    else:
+        df_days = calendar.trading_days(
+            start or df["date"].min(), end or df["date"].max()
+        )
+    df_grid = (
+        pl.DataFrame({"scheme_code": schemes}, schema={"scheme_code": pl.String})
+        .join(df_days.to_frame(), how="cross")
+        .sort("date")
+    )
+    if fill == "ffill":
+        df = df_grid.join_asof(
+            df.sort("date"),
+            on="date",
+            by="scheme_code",
+            strategy="backward",
+            tolerance=max_gap,
+            check_sortedness=False,
+        )
+    else:
+        df = df_grid.join(df, on=["scheme_code", "date"], how="left")
+    df = df.sort("scheme_code", "date")
+
+    if wide:
+        return df.pivot(on="scheme_code", index="date", values="nav").sort("date")
+    return df
@@ -0,0 +1,465 @@
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import pathlib
+import random
+import threading
+import time
+from typing import Callable, Iterable, NamedTuple
+from urllib.parse import urlsplit
+
+import aiohttp
+import polars as pl
+import requests
+from requests.adapters import HTTPAdapter
+
+from httpcache import CachedResponse, ResponseCache
+
+BASE_URL = "https://portal.amfiindia.com/DownloadNAVHistoryReport_Po.aspx?tp=1&frmdt={FRMDT}&todt={TODT}"
+
+# Responses which are worth retrying: rate limiting and server errors.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class Window(NamedTuple):
+    """
+    A date range of the NAV history report, both ends included.
+    """
+
+    start_date: datetime.date
+    end_date: datetime.date
+
+    @property
+    def name(self) -> str:
+        return f"{self.start_date.strftime('%Y%m%d')}_{self.end_date.strftime('%Y%m%d')}"
+
+    def url(self, base_url: str = BASE_URL) -> str:
+        return base_url.format(
+            FRMDT=self.start_date.strftime("%d-%b-%Y"),
+            TODT=self.end_date.strftime("%d-%b-%Y"),
+        )
+
+
+def plan_windows(df_gaps: pl.DataFrame, max_days: int = 7) -> list[Window]:
+    """
+    Plan the fewest report windows, each spanning at most max_days days, covering all the missing date ranges.
+
+    Each report contains all the schemes, so the missing ranges of all the schemes are covered together. Windows are
+    laid greedily from the earliest missing date, which gives the fewest windows for a maximum span. A window may
+    also cover days which are already available in between two missing ranges.
+
+    Args:
+        df_gaps (pl.DataFrame): Missing ranges with the columns 'start_date' and 'end_date' (both included), for
+                   instance from availability.find_gaps.
+        max_days (int): Maximum number of days in a window.
+
+    Returns:
+        list[Window]: The windows to download, in date order.
+    """
+    span = datetime.timedelta(days=max_days - 1)
+    one_day = datetime.timedelta(days=1)
+    windows: list[Window] = []
+    for start, end in sorted(df_gaps.select("start_date", "end_date").iter_rows()):
+        if windows and start <= windows[-1].start_date + span:
+            # Stretch the last window over as much of this range as it can take
+            last = windows[-1]
+            windows[-1] = Window(
+                last.start_date, max(last.end_date, min(end, last.start_date + span))
+            )
+            start = windows[-1].end_date + one_day
+        while start <= end:
+            windows.append(Window(start, min(end, start + span)))
+            start = windows[-1].end_date + one_day
+    return windows
+
+
+class RateLimiter:
+    """
+    Limit the number of requests per second sent to each host.
+
+    Requests to the same host are spaced by at least 1 / rate seconds, whichever thread sends them.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self._next: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, url: str) -> float:
+        """
+        Reserve the next slot for a request to the host of url.
+
+        Returns:
+            float: The number of seconds to wait before sending the request.
+        """
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + self.interval
+        return slot - now
+
+    def wait(self, url: str):
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Manifest:
+    """
+    The list of windows which were already downloaded and processed, stored as a JSON file.
+
+    The file is rewritten after every completed window, so an interrupted download can be resumed from where it
+    stopped.
+    """
+
+    def __init__(self, path: str | pathlib.Path):
+        self.path = pathlib.Path(path)
+        self._lock = threading.Lock()
+        self._done: set[str] = set()
+        if self.path.exists():
+            self._done = set(json.loads(self.path.read_text())["completed"])
+
+    def __contains__(self, window: Window) -> bool:
+        return window.name in self._done
+
+    def add(self, window: Window):
+        with self._lock:
+            self._done.add(window.name)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps({"completed": sorted(self._done)}, indent=2))
+            tmp_path.replace(self.path)
+
+
+class Downloader:
+    """
+    Download NAV history reports with a shared connection pool, bounded concurrency, retries and rate limiting.
+
+    Failed requests (connection errors, timeouts, 429 and 5xx responses) are retried with exponential backoff and
+    full jitter, honouring the Retry-After header when the server sends one.
+
+    Args:
+        base_url (str): URL template with {FRMDT} and {TODT} placeholders. Point it to a local server for testing.
+        max_workers (int): Maximum number of requests in flight.
+        retries (int): Maximum number of retries for each request.
+        backoff (float): Base delay in seconds before the first retry. Doubles with every retry.
+        max_backoff (float): Maximum delay in seconds between two attempts.
+        rate (float): Maximum number of requests per second to each host. 0 disables the limit.
+        timeout (tuple[float, float]): Connect and read timeouts in seconds.
+        cache (ResponseCache | None): Cache of the responses. Reports of closed windows are served from it without
+                   touching the network, and other responses are revalidated with a conditional GET.
+        settle_days (int): Number of days after which the report of a window is considered final.
+    """
+
+    def __init__(
+        self,
+        base_url: str = BASE_URL,
+        max_workers: int = 4,
+        retries: int = 5,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        rate: float = 2.0,
+        timeout: tuple[float, float] = (10, 300),
+        cache: ResponseCache | None = None,
+        settle_days: int = 7,
+    ):
+        self.base_url = base_url
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(rate)
+        self.cache = cache
+        self.settle_days = settle_days
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _delay(self, attempt: int, headers=None) -> float:
+        if headers is not None and headers.get("Retry-After", "").isdigit():
+            return min(self.max_backoff, float(headers["Retry-After"]))
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def _lookup(self, url: str) -> CachedResponse | None:
+        return self.cache.get(url) if self.cache is not None else None
+
+    def _accept(
+        self,
+        url: str,
+        cached: CachedResponse | None,
+        immutable: bool,
+        status: int,
+        headers,
+        content: bytes,
+    ) -> tuple[bytes, str] | None:
+        """
+        Handle a response: store it in the cache and return its body and content type, or None if it is worth
+        retrying.
+
+        Only text files are stored as immutable. Anything else, such as an error or maintenance page sent with a 200,
+        is revalidated on the next request instead of being kept forever.
+        """
+        if status == 304 and cached is not None:
+            # Not modified: keep the cached body, with the validators of the new response
+            self.cache.put(
+                url,
+                cached.content,
+                {
+                    "Content-Type": cached.content_type,
+                    "ETag": headers.get("ETag", cached.etag),
+                    "Last-Modified": headers.get("Last-Modified", cached.last_modified),
+                },
+                immutable and "text/plain" in cached.content_type,
+            )
+            return cached.content, cached.content_type
+        if status in RETRY_STATUSES:
+            return None
+        if status >= 400:
+            raise requests.HTTPError(f"{status} for {url}")
+        content_type = headers.get("Content-Type", "")
+        if self.cache is not None:
+            self.cache.put(
+                url, content, headers, immutable and "text/plain" in content_type
+            )
+        return content, content_type
+
+    def is_closed(self, window: Window) -> bool:
+        """
+        Whether the report of a window is final: NAVs of the window can no longer be published or revised.
+        """
+        return window.end_date <= datetime.date.today() - datetime.timedelta(
+            days=self.settle_days
+        )
+
+    def get(self, url: str, immutable: bool = False) -> tuple[bytes, str]:
+        """
+        Download a URL with retries, through the response cache if there is one.
+
+        Args:
+            url (str): The URL.
+            immutable (bool): Whether the response can never change. Cached immutable responses are returned without
+                   touching the network, other cached responses are revalidated. Only text files are cached as
+                   immutable.
+
+        Returns:
+            tuple[bytes, str]: The body and the content type of the response.
+
+        Raises:
+            requests.RequestException: If the request still fails after all the retries.
+        """
+        cached = self._lookup(url)
+        if cached is not None and cached.immutable:
+            return cached.content, cached.content_type
+        headers = cached.validators() if cached is not None else {}
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.wait(url)
+            response = None
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+                result = self._accept(
+                    url,
+                    cached,
+                    immutable,
+                    response.status_code,
+                    response.headers,
+                    response.content,
+                )
+                if result is not None:
+                    return result
+                error = requests.HTTPError(
+                    f"{response.status_code} for {url}", response=response
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt < self.retries:
+                time.sleep(
+                    self._delay(attempt, response.headers if response is not None else None)
+                )
+        raise error
+
+    async def get_async(
+        self, client: aiohttp.ClientSession, url: str, immutable: bool = False
+    ) -> tuple[bytes, str]:
+        """
+        Same as get, without blocking the event loop.
+
+        Args:
+            client (aiohttp.ClientSession): The HTTP client.
+            url (str): The URL.
+            immutable (bool): Whether the response can never change.
+
+        Returns:
+            tuple[bytes, str]: The body and the content type of the response.
+        """
+        cached = self._lookup(url)
+        if cached is not None and cached.immutable:
+            return cached.content, cached.content_type
+        headers = cached.validators() if cached is not None else {}
+        for attempt in range(self.retries + 1):
+            await asyncio.sleep(self.rate_limiter.reserve(url))
+            response_headers = None
+            try:
+                async with client.get(url, headers=headers) as response:
+                    status, response_headers = response.status, response.headers
+                    content = await response.read()
+                result = self._accept(
+                    url, cached, immutable, status, response_headers, content
+                )
+                if result is not None:
+                    return result
+                error = requests.HTTPError(f"{status} for {url}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            if attempt < self.retries:
+                await asyncio.sleep(self._delay(attempt, response_headers))
+        raise error
+
+    def fetch(self, window: Window) -> bytes | None:
+        """
+        Download the report of a window. Reports of closed windows (see is_closed) are cached as immutable.
+
+        Returns:
+            bytes | None: The report, or None if the server did not send a text file (no data for the window).
+
+        Raises:
+            requests.RequestException: If the request still fails after all the retries.
+        """
+        content, content_type = self.get(
+            window.url(self.base_url), immutable=self.is_closed(window)
+        )
+        if "text/plain" not in content_type:
+            return None
+        return content
+
+    async def fetch_async(
+        self, client: aiohttp.ClientSession, window: Window
+    ) -> bytes | None:
+        """
+        Same as fetch, without blocking the event loop. See get_async for client.
+        """
+        content, content_type = await self.get_async(
+            client, window.url(self.base_url), immutable=self.is_closed(window)
+        )
+        if "text/plain" not in content_type:
+            return None
+        return content
+
+    @staticmethod
+    def _report(idx: int, total: int, window: Window, downloaded: bool | None, error):
+        if error is not None:
+            print(
+                f"Failed to download or process the file for {window.start_date} to {window.end_date}: {error}"
+            )
+        elif downloaded:
+            print(f"Downloaded ({idx + 1} of {total}): {window.name}")
+        else:
+            print(f"Skipping non-text file: {window.name}")
+
+    def download(
+        self,
+        windows: Iterable[Window],
+        handle: Callable[[Window, bytes], None],
+        manifest: Manifest | None = None,
+    ) -> list[Window]:
+        """
+        Download all the windows which are not in the manifest and hand each report over to handle.
+
+        handle is called from the worker threads as soon as a report is downloaded. A window is added to the manifest
+        only after handle returns, so a window is either fully processed or downloaded again on the next run. Windows
+        for which the server has no data yet, like today's before its NAVs are published, are neither handled nor
+        added to the manifest.
+
+        Returns:
+            list[Window]: The windows which could not be downloaded or processed.
+        """
+        pending = [w for w in windows if manifest is None or w not in manifest]
+        failed = []
+
+        def task(window: Window) -> bool:
+            content = self.fetch(window)
+            if content is None:
+                return False
+            handle(window, content)
+            if manifest is not None:
+                manifest.add(window)
+            return True
+
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            futures = {executor.submit(task, w): w for w in pending}
+            for idx, future in enumerate(concurrent.futures.as_completed(futures)):
+                window = futures[future]
+                try:
+                    self._report(idx, len(pending), window, future.result(), None)
+                except Exception as e:
+                    self._report(idx, len(pending), window, None, e)
+                    failed.append(window)
+        if self.cache is not None:
+            self.cache.save()
+        return failed
+
+    def download_async(
+        self,
+        windows: Iterable[Window],
+        handle: Callable[[Window, bytes], None],
+        manifest: Manifest | None = None,
+    ) -> list[Window]:
+        """
+        Same as download, with the requests sent with aiohttp from an asyncio event loop instead of one thread per
+        request.
+
+        At most max_workers requests are in flight, over one pooled connection per request in flight. Each report is
+        handed over to handle as soon as it is downloaded, in a worker thread so the event loop keeps downloading
+        while it is parsed. A slot is only released once its report is handled, so at most max_workers reports are
+        held in memory.
+
+        Returns:
+            list[Window]: The windows which could not be downloaded or processed.
+        """
+        return asyncio.run(self._download_async(windows, handle, manifest))
+
+    async def _download_async(
+        self,
+        windows: Iterable[Window],
+        handle: Callable[[Window, bytes], None],
+        manifest: Manifest | None,
+    ) -> list[Window]:
+        pending = [w for w in windows if manifest is None or w not in manifest]
+        failed = []
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def task(client, window: Window):
+            try:
+                async with semaphore:
+                    content = await self.fetch_async(client, window)
+                    if content is None:
+                        return window, False, None
+                    await asyncio.to_thread(handle, window, content)
+                if manifest is not None:
+                    manifest.add(window)
+                return window, True, None
+            except Exception as e:
+                return window, None, e
+
+        async def run(client):
+            tasks = [task(client, w) for w in pending]
+            for idx, result in enumerate(asyncio.as_completed(tasks)):
+                window, downloaded, error = await result
+                self._report(idx, len(pending), window, downloaded, error)
+                if error is not None:
+                    failed.append(window)
+
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_workers),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=self.timeout[0], sock_read=self.timeout[1]
+            ),
+        ) as client:
+            await run(client)
+        if self.cache is not None:
+            self.cache.save()
+        return failed
@@ -1,49 +1,229 @@
+import datetime
+import io
+import pathlib
+
 import polars as pl
 
-df = pl.scan_csv(
-    "https://www.amfiindia.com/spages/NAVAll.txt?t=15012022025700",
-    separator=";",
-    null_values=["N.A.", "-"],
-    infer_schema=False,
-)
-df = df.drop_nulls(subset=["Scheme Code"])
-df = df.with_columns(
-    group_header=pl.when(
-        pl.col("Date").is_null()
-        & pl.col("Scheme Code").str.to_lowercase().str.contains("scheme")
-    )
-    .then(pl.col("Scheme Code"))
-    .forward_fill(),
-    fund_house=pl.when(
-        pl.col("Date").is_null()
-        & pl.col("Scheme Code").str.to_lowercase().str.contains("fund")
-    )
-    .then(pl.col("Scheme Code"))
-    .forward_fill(),
-)
+from availability import update_coverage
+from compact import SchemeIds, from_compact, to_compact
+from download import Downloader
+from httpcache import ResponseCache
+from navstore import NavStore
+from returns import ReturnStore
 
-df = df.filter(pl.col("Date").is_not_null())
-df = df.select(
-    pl.col("Scheme Code").alias("schme_code"),
-    pl.col("Net Asset Value").cast(pl.Decimal(None, 4)).alias("nav"),
-    pl.col("group_header").alias("scheme_type"),
-    pl.col("fund_house").alias("fund_house"),
-    pl.col("Scheme Name").alias("scheme_name"),
-    pl.col("Date").str.to_date("%d-%b-%Y").alias("date"),
-)
-# Write Metadata
-df_meta = df.select(
-    pl.col("schme_code"),
-    pl.col("scheme_type"),
-    pl.col("fund_house"),
-    pl.col("scheme_name"),
-)
-df_meta.collect().write_parquet("metadata.parquet")
+NAV_ALL_URL = "https://www.amfiindia.com/spages/NAVAll.txt?t=15012022025700"
 
-# Write Data
-df_data = df.select(
-    pl.col("schme_code"),
-    pl.col("nav"),
-    pl.col("date"),
+METADATA_PATH = "metadata.parquet"
+
+# Scheme attributes tracked by the metadata dimension. A change in any of them starts a new version of the scheme.
+ATTRIBUTES = ["scheme_type", "fund_house", "scheme_name"]
+
+METADATA_SCHEMA = pl.Schema(
+    {
+        "scheme_code": pl.String(),
+        "scheme_type": pl.String(),
+        "fund_house": pl.String(),
+        "scheme_name": pl.String(),
+        "valid_from": pl.Date(),
+        "valid_to": pl.Date(),
+    }
 )
-df_data.collect().write_parquet("data.parquet")
\ No newline at end of file
+
+
+def load_metadata(
+    as_of: datetime.date | None = None,
+    path: str = METADATA_PATH,
+    scheme_ids: SchemeIds | None = None,
+) -> pl.LazyFrame:
+    """
+    Read the scheme metadata dimension.
+
+    Args:
+        as_of (datetime.date | None): Only return the version of each scheme valid on this date. If None, return all
+                   the versions.
+        path (str): Path of the dimension file.
+        scheme_ids (SchemeIds | None): The scheme IDs the file was written with. If None, the default SchemeIds.
+
+    Returns:
+        pl.LazyFrame: The columns of METADATA_SCHEMA, sorted by scheme ID and valid_from. valid_to is null for the
+                   current version of each scheme.
+    """
+    if not pathlib.Path(path).exists():
+        return pl.LazyFrame(schema=METADATA_SCHEMA)
+    scheme_ids = scheme_ids or SchemeIds()
+    df = from_compact(pl.scan_parquet(path), scheme_ids.load())
+    if as_of is not None:
+        df = df.filter(
+            pl.col("valid_from") <= as_of,
+            pl.col("valid_to").is_null() | (pl.col("valid_to") >= as_of),
+        )
+    return df
+
+
+def update_metadata(
+    df_snapshot: pl.DataFrame,
+    path: str = METADATA_PATH,
+    scheme_ids: SchemeIds | None = None,
+) -> pl.DataFrame:
+    """
+    Merge a snapshot of scheme metadata into the slowly changing scheme dimension.
+
+    The dimension has one row per version of each scheme, valid from 'valid_from' to 'valid_to' (both included,
+    null for the current version). A scheme gets a new version only when its scheme type, fund house or name differs
+    from its current version, and the current version then ends the day before. Unchanged schemes are left as they
+    are, so the dimension grows with the number of changes and not with the number of runs.
+
+    The file is stored in the compact form (see compact.py), sorted by scheme ID and valid_from so that lookups of a
+    scheme only read the row groups containing it. Its IDs come from the same SchemeIds as the compact NAV files, so
+    the two can be joined on scheme_id:
+
+    >>> import tempfile
+    >>> tmp = pathlib.Path(tempfile.mkdtemp())
+    >>> scheme_ids = SchemeIds(tmp / "scheme_ids.parquet")
+    >>> store = NavStore(tmp / "navstore", compact=True, scheme_ids=scheme_ids)
+    >>> day = datetime.date(2025, 1, 1)
+    >>> store.upsert(pl.DataFrame({"scheme_code": ["B", "A"], "nav": ["10.5", "20.25"], "date": [day, day]}))
+    >>> df_snapshot = pl.DataFrame(
+    ...     {"scheme_code": ["A", "B"], "date": [day, day], "scheme_type": ["Equity", "Debt"],
+    ...      "fund_house": ["X", "Y"], "scheme_name": ["Fund A", "Fund B"]}
+    ... )
+    >>> _ = update_metadata(df_snapshot, tmp / "metadata.parquet", scheme_ids)
+    >>> by_id = store.scan(decode=False).join(pl.scan_parquet(tmp / "metadata.parquet"), on="scheme_id")
+    >>> by_code = store.scan().join(load_metadata(path=tmp / "metadata.parquet", scheme_ids=scheme_ids), on="scheme_code")
+    >>> from_compact(by_id, scheme_ids.load()).sort("scheme_code").collect().equals(by_code.sort("scheme_code").collect())
+    True
+
+    Args:
+        df_snapshot (pl.DataFrame): The current metadata, with the columns 'scheme_code', 'date' (the date the
+                   metadata applies from) and ATTRIBUTES.
+        path (str): Path of the dimension file.
+        scheme_ids (SchemeIds | None): The scheme IDs shared by the compact files. If None, the default SchemeIds.
+
+    Returns:
+        pl.DataFrame: The updated dimension, with scheme codes.
+    """
+    df_snapshot = df_snapshot.unique(
+        subset="scheme_code", keep="last", maintain_order=True
+    )
+    scheme_ids = scheme_ids or SchemeIds()
+    df_ids = scheme_ids.update(df_snapshot["scheme_code"])
+    # Files written before the dimension had validity dates hold no history, and are replaced
+    if pathlib.Path(path).exists() and "valid_from" in pl.read_parquet_schema(path):
+        df_dim = from_compact(pl.scan_parquet(path), df_ids).collect()
+    else:
+        df_dim = pl.DataFrame(schema=METADATA_SCHEMA)
+
+    # New schemes, and schemes whose attributes differ from their current version. Snapshots older than the current
+    # version are ignored.
+    df_current = df_dim.filter(pl.col("valid_to").is_null())
+    df_changed = (
+        df_snapshot.join(
+            df_current, on=["scheme_code", *ATTRIBUTES], how="anti", nulls_equal=True
+        )
+        .join(
+            df_current.select("scheme_code", "valid_from"),
+            on="scheme_code",
+            how="left",
+        )
+        .filter(
+            pl.col("valid_from").is_null() | (pl.col("date") > pl.col("valid_from"))
+        )
+    )
+    if df_changed.is_empty():
+        return df_dim
+
+    df_dim = (
+        pl.concat(
+            [
+                df_dim.join(
+                    df_changed.select("scheme_code", pl.col("date").alias("_changed")),
+                    on="scheme_code",
+                    how="left",
+                )
+                .with_columns(
+                    pl.when(pl.col("valid_to").is_null())
+                    .then(pl.col("_changed") - datetime.timedelta(days=1))
+                    .otherwise(pl.col("valid_to"))
+                    .alias("valid_to")
+                )
+                .drop("_changed"),
+                df_changed.select(
+                    pl.col("scheme_code"),
+                    *ATTRIBUTES,
+                    pl.col("date").alias("valid_from"),
+                    pl.lit(None, pl.Date).alias("valid_to"),
+                ),
+            ]
+        )
+        .join(df_ids, on="scheme_code", how="left")
+        .sort("scheme_id", "valid_from")
+        .drop("scheme_id")
+    )
+
+    tmp_path = pathlib.Path(path).with_suffix(".tmp")
+    to_compact(df_dim, df_ids).collect().write_parquet(tmp_path)
+    tmp_path.replace(path)
+    return df_dim
+
+
+if __name__ == "__main__":
+    # The feed is revalidated with a conditional GET, and only downloaded again when it changed
+    content, _ = Downloader(cache=ResponseCache()).get(NAV_ALL_URL)
+    df = pl.read_csv(
+        io.BytesIO(content),
+        separator=";",
+        null_values=["N.A.", "-"],
+        infer_schema=False,
+    )
+    df = df.drop_nulls(subset=["Scheme Code"])
+    df = df.with_columns(
+        group_header=pl.when(
+            pl.col("Date").is_null()
+            & pl.col("Scheme Code").str.to_lowercase().str.contains("scheme")
+        )
+        .then(pl.col("Scheme Code"))
+        .forward_fill(),
+        fund_house=pl.when(
+            pl.col("Date").is_null()
+            & pl.col("Scheme Code").str.to_lowercase().str.contains("fund")
+        )
+        .then(pl.col("Scheme Code"))
+        .forward_fill(),
+    )
+
+    df = df.filter(pl.col("Date").is_not_null())
+    df = df.select(
+        pl.col("Scheme Code").alias("scheme_code"),
+        pl.col("Net Asset Value").cast(pl.Decimal(None, 4)).alias("nav"),
+        pl.col("group_header").alias("scheme_type"),
+        pl.col("fund_house").alias("fund_house"),
+        pl.col("Scheme Name").alias("scheme_name"),
+        pl.col("Date").str.to_date("%d-%b-%Y").alias("date"),
+    )
+
+    # Update Metadata. The feed is parsed once, and both outputs are split from it: the scheme IDs of the data are only
+    # known after the metadata update, so the two cannot be written by one lazy query.
+    df_meta = df.select(
+        pl.col("scheme_code"),
+        pl.col("date"),
+        *ATTRIBUTES,
+    )
+    # One scheme ID dimension is shared by all the compact files, so that they can be joined on scheme_id
+    scheme_ids = SchemeIds()
+    update_metadata(df_meta, scheme_ids=scheme_ids)
+
+    # Write Data, in the compact form with integer scheme IDs. Read it with data.read_funds.
+    df_data = df.select(
+        pl.col("scheme_code"),
+        pl.col("nav"),
+        pl.col("date"),
+    )
+    to_compact(df_data, scheme_ids.load()).collect().write_parquet("data.parquet")
+
+    # The NAVs are also added to the history in the NAV store, which get_nav reads, as multiples.py does for the
+    # reports it downloads
+    store = NavStore()
+    store.upsert(df_data)
+    update_coverage(df_data)
+    returns = ReturnStore()
+    returns.update(df_data if returns.partitions() else store.scan(), store)
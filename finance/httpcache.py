@@ -0,0 +1,203 @@
+import collections
+import hashlib
+import json
+import pathlib
+import threading
+import time
+from typing import NamedTuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+CACHE_DIR = "httpcache"
+
+# Default size of the cached bodies, beyond which the least recently used responses are evicted
+MAX_CACHE_BYTES = 1 << 30
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize a URL into a cache key: lowercase scheme and host, sorted query parameters and no fragment.
+
+    The query holds the date range of the report, so each window has its own key.
+    """
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", query, "")
+    )
+
+
+class CachedResponse(NamedTuple):
+    """
+    A response stored in the cache.
+    """
+
+    content: bytes
+    content_type: str
+    # Never revalidated when True
+    immutable: bool
+    etag: str | None
+    last_modified: str | None
+
+    def validators(self) -> dict[str, str]:
+        """
+        The headers of a conditional GET revalidating this response.
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    A local, content-addressed cache of HTTP responses.
+
+    Bodies are stored once under `<root>/objects/`, named by their SHA-256, and `<root>/index.json` maps each
+    normalized URL to its body, content type, validators (ETag and Last-Modified) and whether it is immutable.
+    Identical responses for different URLs, like the page AMFI sends for a window without data, share one file.
+
+    Immutable responses, such as the reports of closed historical windows, are served without touching the network.
+    Other responses are revalidated with a conditional GET, see CachedResponse.validators. When the bodies take more
+    than max_bytes, the least recently used responses are evicted.
+
+    Example:
+    >>> cache = ResponseCache()
+    >>> cached = cache.get(url)
+    >>> cache.put(url, response.content, response.headers, immutable=True)
+    """
+
+    def __init__(
+        self, root: str | pathlib.Path = CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES
+    ):
+        self.root = pathlib.Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index: dict[str, dict] = {}
+        index_path = self.root / "index.json"
+        if index_path.exists():
+            self._index = json.loads(index_path.read_text())
+        # Number of URLs sharing each body, and the total size of the distinct bodies
+        self._refs: collections.Counter[str] = collections.Counter(
+            entry["sha256"] for entry in self._index.values()
+        )
+        self._bytes = sum(
+            {entry["sha256"]: entry["size"] for entry in self._index.values()}.values()
+        )
+
+    def _object_path(self, digest: str) -> pathlib.Path:
+        return self.root / "objects" / digest[:2] / digest
+
+    def get(self, url: str) -> CachedResponse | None:
+        """
+        Look up the cached response of a URL.
+
+        The time of use is only updated in memory, and written with the index by the next put or save.
+
+        Returns:
+            CachedResponse | None: The response, or None if the URL is not cached or its body was removed.
+        """
+        key = normalize_url(url)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            entry["used"] = time.time()
+        try:
+            content = self._object_path(entry["sha256"]).read_bytes()
+        except FileNotFoundError:
+            with self._lock:
+                if self._index.get(key) is entry:
+                    self._remove(key)
+            return None
+        return CachedResponse(
+            content,
+            entry["content_type"],
+            entry["immutable"],
+            entry["etag"],
+            entry["last_modified"],
+        )
+
+    def put(
+        self, url: str, content: bytes, headers, immutable: bool = False
+    ) -> CachedResponse:
+        """
+        Store the response of a URL, replacing any previous response, and evict old responses if needed.
+
+        Args:
+            url (str): The requested URL.
+            content (bytes): The body of the response.
+            headers: The headers of the response, for the content type and validators.
+            immutable (bool): Whether the response can be served without revalidation from now on.
+
+        Returns:
+            CachedResponse: The stored response.
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._object_path(digest)
+        entry = {
+            "url": url,
+            "sha256": digest,
+            "size": len(content),
+            "content_type": headers.get("Content-Type", ""),
+            "immutable": immutable,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "used": time.time(),
+        }
+        key = normalize_url(url)
+        with self._lock:
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_suffix(".tmp")
+                tmp_path.write_bytes(content)
+                tmp_path.replace(path)
+            # The new body is counted before the old one is released, so that a body shared by both is kept
+            if self._refs[digest] == 0:
+                self._bytes += len(content)
+            self._refs[digest] += 1
+            if key in self._index:
+                self._remove(key)
+            self._index[key] = entry
+            self._evict()
+            self._save()
+        return CachedResponse(
+            content,
+            entry["content_type"],
+            immutable,
+            entry["etag"],
+            entry["last_modified"],
+        )
+
+    def save(self):
+        """
+        Write the index, with the times of use of the responses looked up since the last write.
+        """
+        with self._lock:
+            self._save()
+
+    def _remove(self, key: str):
+        # Drop an entry, and its body once no other URL uses it
+        entry = self._index.pop(key)
+        digest = entry["sha256"]
+        self._refs[digest] -= 1
+        if self._refs[digest] == 0:
+            del self._refs[digest]
+            self._bytes -= entry["size"]
+            self._object_path(digest).unlink(missing_ok=True)
+
+    def _evict(self):
+        if self._bytes <= self.max_bytes:
+            return
+        for key, _ in sorted(self._index.items(), key=lambda item: item[1]["used"]):
+            if self._bytes <= self.max_bytes:
+                break
+            self._remove(key)
+
+    def _save(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        index_path = self.root / "index.json"
+        tmp_path = index_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self._index, indent=2))
+        tmp_path.replace(index_path)
@@ -1,113 +1,108 @@
-import concurrent.futures
 import datetime
-import tempfile
+import io
 import pathlib
+import shutil
+import sys
 import polars as pl
-import requests
 import time
-from typing import List
-
-
-def download_file(url, directory, filename):
-    try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()  # Raise an error for bad responses
-        if "text/plain" not in response.headers["Content-Type"]:
-            print(f"Skipping non-text file: {filename}")
-            return None
-        path = pathlib.Path(directory, filename)
-        with path.open("wb") as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    file.write(chunk)
-        return file.name
-    except requests.RequestException as e:
-        print(f"Error downloading {url}: {e}")
-        return None
-
-
-start_date = datetime.date(2025, 1, 1)
-end_date = datetime.date.today()
-
-date_range = pl.date_range(
-    start=start_date,
-    end=end_date,
-    interval="1d",
-    closed="both",
-    eager=True,
-)
-df = (
-    date_range.alias("date")
-    .to_frame()
-    .group_by_dynamic("date", every="1w")
-    .agg(
-        [
-            pl.col("date").first().alias("start_date"),
-            pl.col("date").last().alias("end_date"),
-        ]
-    )
-)
-
-queries = []
-BASE_URL = "https://portal.amfiindia.com/DownloadNAVHistoryReport_Po.aspx?tp=1&frmdt={FRMDT}&todt={TODT}"
-
-print("Downloading files")
-start_time = time.perf_counter()
-with tempfile.TemporaryDirectory() as temp_dir:
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = []
-        for row in df.iter_rows(named=True):
-            start_date = row["start_date"]
-            end_date = row["end_date"]
-            url = BASE_URL.format(
-                FRMDT=start_date.strftime("%d-%b-%Y"),
-                TODT=end_date.strftime("%d-%b-%Y"),
-            )
-            filename = (
-                f"{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}.txt"
-            )
-            futures.append(executor.submit(download_file, url, temp_dir, filename))
-
-        for idx, future in enumerate(concurrent.futures.as_completed(futures)):
-            result = future.result()
-
-            if result:
-                print(f"Downloaded ({idx + 1} of {len(futures)}): {result}")
-            else:
-                print(
-                    f"Failed to download or process the file for {start_date} to {end_date}"
-                )
-    end_time = time.perf_counter()
-    print(f"Time taken to download files: {end_time - start_time:.2f} seconds")
 
-    # Check if any files were downloaded
-    if not any(pathlib.Path(temp_dir).glob("*.txt")):
-        print("No files were downloaded.")
-        exit(1)
+from availability import find_gaps, rebuild_coverage, update_coverage
+from download import Downloader, Manifest, Window, plan_windows
+from httpcache import ResponseCache
+from navstore import NavStore
+from returns import ReturnStore
 
-    # Process the downloaded files
-    print("Saving data")
-    start = time.perf_counter()
-    df = pl.scan_csv(
-        f"{temp_dir}/*.txt",
+# Parsed reports are kept here until they are merged into the NAV store, so an interrupted run can resume.
+STAGING_DIR = "navhistory"
+
+
+def parse_history(content: bytes) -> pl.DataFrame:
+    """
+    Parse a NAV history report downloaded from AMFI.
+
+    Group headers (scheme type and fund house) and blank lines have no date and are dropped.
+    """
+    df = pl.read_csv(
+        io.BytesIO(content),
         separator=";",
         null_values=["N.A.", "-"],
         infer_schema=False,
     )
-    df = df.drop_nulls(subset=["Scheme Code", "Date"]).select(
+    return df.drop_nulls(subset=["Scheme Code", "Date"]).select(
         pl.col("Scheme Code").cast(pl.String()).alias("scheme_code"),
         pl.col("Net Asset Value").cast(pl.Decimal(None, 4)).alias("nav"),
         pl.col("Date").str.to_date("%d-%b-%Y").alias("date"),
     )
 
-    # Check if navdata.parquet exists
-    if pathlib.Path("navdata.parquet").exists():
-        # If it exists, read the file and check for availability
-        df_navdata = pl.read_parquet("navdata.parquet")
-        df = df_navdata.update(df, on=["scheme_code", "date"], how="full")
-        df.write_parquet("navdata.parquet")
-    else:
-        df.sink_parquet("navdata.parquet")
+
+def save_report(window: Window, content: bytes):
+    """
+    Parse a downloaded report as soon as it arrives and stage it as a Parquet file.
+
+    Only one report is held in memory per download in flight, and the raw text is never written to disk.
+    """
+    path = pathlib.Path(STAGING_DIR, f"{window.name}.parquet")
+    tmp_path = path.with_suffix(".tmp")
+    parse_history(content).write_parquet(tmp_path)
+    tmp_path.replace(path)
+
+
+if __name__ == "__main__":
+    start_date = datetime.date(2025, 1, 1)
+    end_date = datetime.date.today()
+
+    # Only download the dates missing for the given schemes, or for all schemes if none are given. With --async, the
+    # reports are downloaded from an asyncio event loop instead of a thread pool.
+    use_async = "--async" in sys.argv
+    schemes = [arg for arg in sys.argv[1:] if arg != "--async"] or None
+
+    store = NavStore()
+    # Move the data of the old single-file layout into the store once, before planning, so that its dates are not
+    # downloaded again. The coverage is rebuilt to count the imported data.
+    if pathlib.Path("navdata.parquet").exists() and not store.partitions():
+        store.upsert(pl.scan_parquet("navdata.parquet"))
+        rebuild_coverage()
+    windows = plan_windows(find_gaps(schemes, start_date, end_date))
+    if not windows:
+        print("NAV data is already up to date.")
+        exit(0)
+
+    print("Downloading files")
+    start_time = time.perf_counter()
+    pathlib.Path(STAGING_DIR).mkdir(exist_ok=True)
+    manifest = Manifest(pathlib.Path(STAGING_DIR, "manifest.json"))
+    # Reports of closed windows never change, so they are only downloaded once even if the staging files are lost
+    downloader = Downloader(cache=ResponseCache())
+    download_reports = (
+        downloader.download_async if use_async else downloader.download
+    )
+    failed = download_reports(windows, save_report, manifest)
+    end_time = time.perf_counter()
+    print(f"Time taken to download files: {end_time - start_time:.2f} seconds")
+
+    if failed:
+        print(f"{len(failed)} files could not be downloaded. Run again to resume.")
+        exit(1)
+
+    # Check if any files were downloaded
+    if not any(pathlib.Path(STAGING_DIR).glob("*.parquet")):
+        print("No files were downloaded.")
+        shutil.rmtree(STAGING_DIR)
+        exit(1)
+
+    # Merge the downloaded files
+    print("Saving data")
+    start = time.perf_counter()
+    df = pl.scan_parquet(f"{STAGING_DIR}/*.parquet")
+
+    # Only the months present in the downloaded files are rewritten
+    store.upsert(df)
+    update_coverage(df)
+    # Returns are derived from the whole NAV history the first time, and then only for the new NAVs
+    returns = ReturnStore()
+    returns.update(df if returns.partitions() else store.scan(), store)
     end = time.perf_counter()
     print(f"Time taken to read and process files: {end - start:.2f} seconds")
-    print(df)
+    print(store.scan(start=start_date).collect())
+
+    shutil.rmtree(STAGING_DIR)
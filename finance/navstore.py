@@ -0,0 +1,220 @@
+import datetime
+import pathlib
+import time
+from typing import Iterable, Iterator
+
+import polars as pl
+
+from compact import SchemeIds, from_compact, to_compact
+
+STORE_DIR = "navstore"
+
+KEY = ["scheme_code", "date"]
+SCHEMA = pl.Schema(
+    {
+        "scheme_code": pl.String(),
+        "nav": pl.Decimal(38, 4),
+        "date": pl.Date(),
+    }
+)
+
+# Rows per Parquet row group. A month of all the schemes is a few hundred thousand rows, and files are sorted by
+# scheme, so each row group covers a narrow range of schemes and a scheme filter skips nearly all of them.
+ROW_GROUP_SIZE = 16_384
+
+
+class NavStore:
+    """
+    NAV history stored as Parquet files partitioned by month.
+
+    The files of a month live in `<root>/year=YYYY/month=MM/`, each one sorted by scheme code and date, in row groups
+    of ROW_GROUP_SIZE rows with min/max statistics. Writes only touch the partitions of the data being written, and
+    readers only open the partitions overlapping the requested dates, with the remaining filters pushed down to the
+    Parquet scan so that row groups of other schemes are skipped.
+
+    - `append` adds a new file to each partition and never rewrites existing data.
+    - `upsert` rewrites only the partitions of the new data, with new rows replacing existing rows with the same
+      scheme code and date.
+    - `compact` merges the files of each partition into one, keeping the latest row for each scheme code and date.
+
+    With compact=True, the files store integer scheme IDs (see compact.SchemeIds) and NAVs as scaled Int64 instead of
+    strings and decimals. The IDs come from the scheme_ids dimension passed in, which must be the one shared with the
+    other compact files (metadata.parquet and data.parquet of funds.py), so that they can be joined on scheme_id. `scan` decodes them transparently, or returns the compact
+    columns with decode=False, which take far less memory for large analytics joins.
+
+    Example:
+    >>> store = NavStore()
+    >>> store.upsert(df)
+    >>> store.scan(schemes=["119551"], start=datetime.date(2024, 1, 1)).collect()
+    """
+
+    # Columns of the stored data. Subclasses storing other columns by scheme code and date override it.
+    schema = SCHEMA
+
+    def __init__(
+        self,
+        root: str | pathlib.Path = STORE_DIR,
+        compact: bool = False,
+        scheme_ids: SchemeIds | None = None,
+    ):
+        self.root = pathlib.Path(root)
+        self.is_compact = compact
+        # The shared dimension of all the compact files, scheme_ids.parquet by default
+        self.scheme_ids = scheme_ids or SchemeIds()
+        # Rows are identified by scheme ID instead of scheme code in compact files
+        self.key = ["scheme_id", "date"] if compact else KEY
+
+    def partitions(
+        self, start: datetime.date | None = None, end: datetime.date | None = None
+    ) -> list[pathlib.Path]:
+        """
+        List the partition directories overlapping the given dates, oldest first.
+        """
+        partitions = []
+        for path in sorted(self.root.glob("year=*/month=*")):
+            month = (int(path.parent.name[5:]), int(path.name[6:]))
+            if start is not None and month < (start.year, start.month):
+                continue
+            if end is not None and month > (end.year, end.month):
+                continue
+            partitions.append(path)
+        return partitions
+
+    def files(
+        self, start: datetime.date | None = None, end: datetime.date | None = None
+    ) -> list[pathlib.Path]:
+        """
+        List the data files overlapping the given dates, in the order they were written within each partition.
+        """
+        return [
+            file
+            for partition in self.partitions(start, end)
+            for file in sorted(partition.glob("part-*.parquet"))
+        ]
+
+    def scan(
+        self,
+        schemes: Iterable[str] | None = None,
+        start: datetime.date | None = None,
+        end: datetime.date | None = None,
+        decode: bool = True,
+    ) -> pl.LazyFrame:
+        """
+        Lazily read the NAVs of the given schemes between start and end (both included).
+
+        Partitions outside of the date range are not opened at all, and the scheme code and date filters are pushed
+        down to the Parquet scan so that row groups outside of them are skipped.
+
+        In a compact store, decode=False returns the stored columns 'scheme_id', 'nav' (Int64) and 'date'.
+        """
+        files = self.files(start, end)
+        if not files:
+            df = pl.LazyFrame(schema=self.schema)
+            return df if decode or not self.is_compact else self._encode(df.collect())
+
+        df = pl.scan_parquet(files)
+        if schemes is not None:
+            if self.is_compact:
+                df_ids = self.scheme_ids.load()
+                codes = df_ids["scheme_code"]
+                ids = df_ids["scheme_id"].filter(codes.is_in(list(schemes)))
+                df = df.filter(pl.col("scheme_id").is_in(ids.to_list()))
+                if not ids.is_empty():
+                    # The range of IDs lets row groups be skipped by their statistics, which is_in does not
+                    df = df.filter(
+                        pl.col("scheme_id").is_between(ids.min(), ids.max())
+                    )
+            else:
+                df = df.filter(pl.col("scheme_code").is_in(list(schemes)))
+        if start is not None:
+            df = df.filter(pl.col("date") >= start)
+        if end is not None:
+            df = df.filter(pl.col("date") <= end)
+        if self.is_compact and decode:
+            df = from_compact(df, self.scheme_ids.load())
+        return df
+
+    def _encode(self, df: pl.DataFrame) -> pl.LazyFrame:
+        return to_compact(df, self.scheme_ids.update(df["scheme_code"]))
+
+    def _split(
+        self, df: pl.DataFrame | pl.LazyFrame
+    ) -> Iterator[tuple[pathlib.Path, pl.DataFrame]]:
+        # Only one month of the new rows is collected at a time, so that a multi-year backfill is never held in memory
+        # at once. The distinct months are listed first, and each month is then read with a date range filter, which
+        # lets the scan skip the files and row groups of other dates.
+        df = df.lazy()
+        months = (
+            df.select(
+                pl.col("date").dt.year().alias("year"),
+                pl.col("date").dt.month().alias("month"),
+            )
+            .unique()
+            .sort("year", "month")
+            .collect(engine="streaming")
+        )
+        for year, month in months.iter_rows():
+            first = datetime.date(year, month, 1)
+            after = (first + datetime.timedelta(days=31)).replace(day=1)
+            # The columns are cast after the filter, which would not be pushed down to the scan through the casts
+            part = (
+                df.filter(pl.col("date") >= first, pl.col("date") < after)
+                .select(
+                    [pl.col(name).cast(dtype) for name, dtype in self.schema.items()]
+                )
+                .collect()
+            )
+            if self.is_compact:
+                part = self._encode(part).collect()
+            yield self.root / f"year={year}" / f"month={month:02d}", part
+
+    def _write(self, partition: pathlib.Path, df: pl.DataFrame) -> pathlib.Path:
+        partition.mkdir(parents=True, exist_ok=True)
+        # File names sort in the order they were written, which decides which duplicate rows are the latest.
+        path = partition / f"part-{time.time_ns():020d}.parquet"
+        tmp_path = path.with_suffix(".tmp")
+        df.sort(self.key).write_parquet(
+            tmp_path, row_group_size=ROW_GROUP_SIZE, statistics=True
+        )
+        tmp_path.replace(path)
+        return path
+
+    def _merge(self, partition: pathlib.Path, df: pl.DataFrame | None = None):
+        files = sorted(partition.glob("part-*.parquet"))
+        frames = [pl.scan_parquet(file) for file in files]
+        if df is not None:
+            frames.append(df.lazy())
+        merged = (
+            pl.concat(frames)
+            .unique(subset=self.key, keep="last", maintain_order=True)
+            .collect()
+        )
+        # The merged file is written before the old ones are removed. If this is interrupted, the merged file is the
+        # latest one and wins over the old files on the next merge.
+        self._write(partition, merged)
+        for file in files:
+            file.unlink()
+
+    def append(self, df: pl.DataFrame | pl.LazyFrame):
+        """
+        Add new rows without rewriting existing data. Use upsert if the rows may already be in the store.
+        """
+        for partition, part in self._split(df):
+            self._write(partition, part)
+
+    def upsert(self, df: pl.DataFrame | pl.LazyFrame):
+        """
+        Insert or replace rows by scheme code and date, rewriting only the partitions of the new rows, one at a time.
+        """
+        for partition, part in self._split(df):
+            self._merge(partition, part)
+
+    def compact(
+        self, start: datetime.date | None = None, end: datetime.date | None = None
+    ):
+        """
+        Merge the files of each partition overlapping the given dates into a single file.
+        """
+        for partition in self.partitions(start, end):
+            if len(list(partition.glob("part-*.parquet"))) > 1:
+                self._merge(partition)
@@ -3,15 +3,75 @@
 import polars as pl
 from datetime import date
 
-from xirr import xirr
+import xirr  # noqa: F401 - registers the `fin` expression namespace
+import hashlib
 import sys
 import pathlib
 
 PATH = "data/indices/*.csv"
+CACHE_DIR = "data/cache/indices"
+
+
+def parse_index(path: pathlib.Path) -> pl.DataFrame:
+    """
+    Read an index CSV downloaded from niftyindices.com.
+    """
+    return pl.read_csv(path, null_values="-").with_columns(
+        Date=pl.col("Date").str.to_date("%d %b %Y")
+    )
+
+
+def cached_index(
+    path: pathlib.Path, cache_dir: str = CACHE_DIR, rebuild: bool = False
+) -> pathlib.Path:
+    """
+    Get the path of the Arrow IPC cache of an index CSV, parsing the CSV only if needed.
+
+    Cache files are named after a hash of the resolved source path along with its size and modification time, so a
+    cache file is valid exactly when its name matches the current source file. Stale cache files of the same source
+    are removed when it is parsed again. If rebuild is True, the CSV is always parsed again.
+    """
+    stat = path.stat()
+    key = hashlib.sha1(str(path.resolve()).encode()).hexdigest()[:16]
+    cache_path = pathlib.Path(cache_dir, f"{key}-{stat.st_size}-{stat.st_mtime_ns}.arrow")
+
+    if rebuild or not cache_path.exists():
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        for stale in cache_path.parent.glob(f"{key}-*.arrow"):
+            stale.unlink()
+        # Write to a temporary file first so that an interrupted run never leaves a partial cache file behind.
+        tmp_path = cache_path.with_suffix(".tmp")
+        parse_index(path).write_ipc(tmp_path, compression="uncompressed")
+        tmp_path.replace(cache_path)
+
+    return cache_path
+
+
+def read_index(
+    path: pathlib.Path, cache_dir: str = CACHE_DIR, rebuild: bool = False
+) -> pl.DataFrame:
+    """
+    Read an index CSV through its memory-mapped Arrow IPC cache (see cached_index).
+    """
+    return pl.read_ipc(cached_index(path, cache_dir, rebuild), memory_map=True)
+
+
+def scan_indices(
+    paths: list[pathlib.Path], cache_dir: str = CACHE_DIR, rebuild: bool = False
+) -> pl.LazyFrame:
+    """
+    Lazily scan several index CSVs at once through their Arrow IPC caches (see cached_index).
+
+    Only the files which changed since the last run are parsed. All the cache files are then read by a single scan,
+    so Polars can read them in parallel as part of the query that uses them.
+    """
+    return pl.scan_ipc(
+        [cached_index(path, cache_dir, rebuild) for path in paths], memory_map=True
+    )
 
 
 def build_sip(
-    df_price: pl.DataFrame,
+    df_price: pl.DataFrame | pl.LazyFrame,
     inv_amount: float,
     step_up: float,
     start_date: date,
@@ -19,29 +79,53 @@ def build_sip(
 ) -> pl.DataFrame:
     """
     Build a SIP DataFrame with investment amounts and dates.
-    """
 
-    # print(df_price)
+    df_price may contain several indices. The monthly SIP dates are built once, and each installment is priced at the
+    first close of the index on or after its SIP date, found with a single searchsorted over the dates of the index.
+    Sessions on days the exchange is usually closed, like Muhurat trading or a Budget day on a Saturday, are actual
+    closes and are used like any other.
 
-    df_dates = pl.date_range(
-        start=start_date, end=end_date, interval="1mo", eager=True
-    ).to_frame(name="Date")
-    # print(df_dates)
+    Args:
+        df_price (pl.DataFrame | pl.LazyFrame): Prices with the columns 'Index Name', 'Date' and 'Close'.
+        inv_amount (float): Monthly SIP amount in the first year.
+        step_up (float): Yearly step-up of the SIP amount, e.g. 0.1 for 10%.
+        start_date (date): Date of the first installment.
+        end_date (date): No installments are made after this date.
+
+    Returns:
+        pl.DataFrame: One row per index and installment, dated with the SIP date.
+    """
+    sip_dates = pl.date_range(start_date, end_date, interval="1mo", eager=True)
+
+    frames = []
+    for (index_name,), df in (
+        df_price.lazy()
+        .select(pl.col("Index Name"), pl.col("Date"), pl.col("Close"))
+        .sort("Date")
+        .collect()
+        .partition_by("Index Name", as_dict=True)
+        .items()
+    ):
+        # The first close on or after each SIP date
+        rows = df["Date"].search_sorted(sip_dates, side="left")
+        # Installments after the last close point to the null appended at the end
+        close = df["Close"].append(pl.Series([None], dtype=df["Close"].dtype))
+        frames.append(
+            pl.DataFrame({"Date": sip_dates, "Close": close.gather(rows)}).select(
+                pl.lit(index_name).alias("Index Name"), pl.col("Date"), pl.col("Close")
+            )
+        )
 
     df_sip = (
-        df_dates.join_asof(
-            df_price.sort("Date"),
-            on="Date",
-            strategy="forward",
-            suffix="_price",
+        pl.concat(frames)
+        .with_columns(
+            # The first SIP date is the start date
+            years=((pl.col("Date") - pl.lit(start_date)) / pl.duration(days=365)).floor(),
         )
+        .sort("Date", maintain_order=True)
         .with_columns(
-            # years=((pl.col("Date") - start_date) / pl.duration(days=365)).floor(),
             inv_amount=(
-                pl.lit(inv_amount)
-                * (1 + pl.lit(step_up)).pow(
-                    ((pl.col("Date") - start_date) / pl.duration(days=365)).floor()
-                )
+                pl.lit(inv_amount) * (1 + pl.lit(step_up)).pow(pl.col("years"))
             ).cast(pl.Decimal(None, 2)),
             nav=pl.col("Close").cast(pl.Decimal(None, 4)),
         )
@@ -57,97 +141,299 @@ def build_sip(
         )
     )
 
-    # print(df_sip)
     return df_sip
 
 
-def get_rolling_returns(
-    df: pl.DataFrame,
-    start_date: date,
-    end_date: date,
-    period: str = "1y",
-    group_by: str = "Index Name",
+def align_prices(
+    df_price: pl.DataFrame, start_date: date, end_date: date
 ) -> pl.DataFrame:
     """
-    Calculate rolling returns for a given period and group by specified column.
+    Align every calendar day between start_date and end_date to the next available price of each index.
+
+    This is the same forward alignment that build_sip does for the SIP dates, but done once for every day so that any
+    SIP schedule can then be priced with a plain join on the date. Days after the last available price are dropped.
     """
+    df_calendar = pl.date_range(
+        start=start_date, end=end_date, interval="1d", eager=True
+    ).to_frame(name="Date")
 
-    pl.duration()
     return (
-        df.set_sorted("Date")
-        .group_by_dynamic(
-            "Date",
-            every="1d",
-            period=period,
-            group_by=group_by,
-            include_boundaries=True,
-            label="datapoint",
+        df_price.select(pl.col("Index Name").unique())
+        .join(df_calendar, how="cross")
+        .sort("Date")
+        .join_asof(
+            df_price.select(pl.col("Index Name"), pl.col("Date"), pl.col("Close"))
+            .filter(pl.col("Date") <= end_date)
+            .sort("Date"),
+            on="Date",
+            by="Index Name",
+            strategy="forward",
+            check_sortedness=False,
         )
-        .agg(
-            (
-                (pl.col("Close").last() / pl.col("Close").first()).pow(
-                    (
-                        1
-                        / (
-                            (pl.col("Date").last() - pl.col("Date").first())
-                            / pl.duration(hours=8766)  # 1 year in hours
-                        )
-                    )
-                )
-                - 1
-            ).alias("Return"),
+        .drop_nulls("Close")
+        .select(pl.col("Index Name"), pl.col("Date"), pl.col("Close").alias("NAV"))
+    )
+
+
+def sweep_sip(
+    df_price: pl.DataFrame,
+    inv_amounts: list[float],
+    step_ups: list[float],
+    start_dates: list[date],
+    end_date: date,
+    sip_days: list[int] | None = None,
+) -> pl.DataFrame:
+    """
+    Simulate a step-up SIP for every combination of the given parameters across all the indices in df_price.
+
+    Prices are aligned to calendar days once (see align_prices). Every SIP schedule, given by a start date and a day
+    of the month, is then priced with a single join, and the investment amounts and step-ups are applied as column
+    math. Since the units bought scale linearly with the SIP amount, and the XIRR does not depend on it at all, the
+    schedules are evaluated once per step-up and only scaled for each amount.
+
+    Unlike build_sip, all the computations use floats instead of decimals.
+
+    Args:
+        df_price (pl.DataFrame): Prices of one or more indices, with the columns 'Index Name', 'Date' and 'Close'.
+        inv_amounts (list[float]): Monthly SIP amounts (in the first year).
+        step_ups (list[float]): Yearly step-ups of the SIP amount, e.g. 0.1 for 10%.
+        start_dates (list[date]): Dates from which the SIPs start.
+        end_date (date): Date at which the SIPs are valued. No installments are made after this date.
+        sip_days (list[int] | None): Days of the month (1 to 28) on which the installments are made. By default, the
+                   day of each start date is used.
+
+    Returns:
+        pl.DataFrame: One row per index and scenario with the total investment, units, final value and XIRR.
+    """
+    if sip_days is not None and any(not 1 <= day <= 28 for day in sip_days):
+        raise ValueError("SIP days must be between 1 and 28.")
+
+    df_start = pl.DataFrame({"Start Date": start_dates}, schema={"Start Date": pl.Date})
+    if sip_days is None:
+        df_start = df_start.with_columns(
+            pl.col("Start Date").dt.day().cast(pl.Int8).alias("SIP Day")
         )
-        .filter(pl.col("_upper_boundary") <= end_date)
-        .filter(pl.col("Date") == pl.col("_lower_boundary"))
+    else:
+        df_start = df_start.join(
+            pl.DataFrame({"SIP Day": sip_days}, schema={"SIP Day": pl.Int8}),
+            how="cross",
+        )
+
+    # First installment: the SIP day of the start month, or of the next month if it is already past.
+    first_date = pl.col("Start Date").dt.month_start().dt.offset_by(
+        pl.format("{}d", pl.col("SIP Day") - 1)
+    )
+    df_schedule = (
+        df_start.with_columns(
+            pl.when(first_date < pl.col("Start Date"))
+            .then(first_date.dt.offset_by("1mo"))
+            .otherwise(first_date)
+            .alias("First Date")
+        )
+        .filter(pl.col("First Date") <= end_date)
+        .with_columns(
+            pl.date_ranges(pl.col("First Date"), end_date, interval="1mo").alias("Date")
+        )
+        .explode("Date")
+        .with_columns(
+            ((pl.col("Date") - pl.col("First Date")) / pl.duration(days=365))
+            .floor()
+            .alias("Years")
+        )
+        .drop("First Date")
+    )
+
+    df_latest = (
+        df_price.filter(pl.col("Date") <= end_date)
+        .sort("Date")
         .group_by("Index Name")
+        .agg(pl.col("Close").last().alias("Latest Close"))
+    )
+
+    keys = ["Index Name", "Start Date", "SIP Day", "Step Up"]
+    df_installments = (
+        df_schedule.join(
+            align_prices(df_price, df_schedule["Date"].min(), end_date), on="Date"
+        )
+        .join(pl.DataFrame({"Step Up": step_ups}, schema={"Step Up": pl.Float64}), how="cross")
+        .with_columns(
+            # Investment for an SIP amount of 1
+            (1 + pl.col("Step Up")).pow(pl.col("Years")).alias("Investment"),
+        )
+    )
+
+    df_scenarios = (
+        df_installments.group_by(keys)
         .agg(
-            pl.col("Return").min().alias(f"{period} Min Return"),
-            pl.col("Return").quantile(0.25).alias(f"{period} 25% Quantile"),
-            pl.col("Return").median().alias(f"{period} Median Return"),
-            pl.col("Return").quantile(0.75).alias(f"{period} 75% Quantile"),
-            pl.col("Return").max().alias(f"{period} Max Return"),
+            pl.len().alias("Installments"),
+            pl.col("Investment").sum(),
+            (pl.col("Investment") / pl.col("NAV")).sum().alias("Units"),
         )
-        .sort("Index Name")
+        .join(df_latest, on="Index Name")
+        .with_columns((pl.col("Units") * pl.col("Latest Close")).alias("Value"))
     )
 
+    df_xirr = (
+        pl.concat(
+            [
+                df_installments.select(
+                    *keys, pl.col("Date"), pl.col("Investment").neg().alias("amount")
+                ),
+                df_scenarios.select(
+                    *keys, pl.lit(end_date).alias("Date"), pl.col("Value").alias("amount")
+                ),
+            ]
+        )
+        .group_by(keys)
+        .agg(pl.col("amount").fin.xirr("Date").alias("XIRR"))
+    )
 
-if __name__ == "__main__":
-    inv_amount = 10_000 if len(sys.argv) < 2 else float(sys.argv[1])
-    step_up = 0.10 if len(sys.argv) < 3 else float(sys.argv[2])
+    return (
+        df_scenarios.join(df_xirr, on=keys)
+        .join(
+            pl.DataFrame({"SIP Amount": inv_amounts}, schema={"SIP Amount": pl.Float64}),
+            how="cross",
+        )
+        .select(
+            pl.col("Index Name"),
+            pl.col("Start Date"),
+            pl.col("SIP Day"),
+            pl.col("SIP Amount"),
+            pl.col("Step Up"),
+            pl.col("Installments"),
+            (pl.col("Investment") * pl.col("SIP Amount")).alias("Total Investment"),
+            (pl.col("Units") * pl.col("SIP Amount")).alias("Total Units"),
+            (pl.col("Value") * pl.col("SIP Amount")).alias("Final Value"),
+            pl.col("XIRR"),
+        )
+        .sort("Index Name", "Start Date", "SIP Day", "SIP Amount", "Step Up")
+    )
 
-    start_date: date | None = None
-    end_date: date | None = None
 
-    sip_data: list[pl.DataFrame] = []
-    raw_data: list[pl.DataFrame] = []
+def get_rolling_returns_multi(
+    df: pl.DataFrame | pl.LazyFrame,
+    start_date: date | pl.Expr,
+    end_date: date | pl.Expr,
+    periods: list[str] | None = None,
+    group_by: str = "Index Name",
+) -> dict[str, pl.DataFrame | pl.LazyFrame]:
+    """
+    Calculate rolling returns for several periods at once and group by specified column.
 
-    for path in pathlib.Path().glob(PATH):
-        print(f"Processing {path}")
+    Every trading day starts one window per period. The close at the end of each window (the last trading day before
+    the start date plus the period) is found with a single sorted as-of join, so the cost grows with the number of
+    days times the number of periods instead of the number of days times the window length.
 
-        df = pl.read_csv(path, null_values="-").with_columns(
-            Date=pl.col("Date").str.to_date("%d %b %Y")
-        )
+    df may be lazy, in which case the summaries are lazy too. The end date may also be an expression evaluated on df,
+    e.g. pl.col("Date").max().
+
+    Returns:
+        dict[str, pl.DataFrame | pl.LazyFrame]: The summary of the rolling returns (min, quartiles and max) for each period.
+    """
 
-        raw_data.append(df)
+    if periods is None:
+        periods = ["1y"]
 
-        start_date = (
-            df.select(pl.col("Date").min()).item() if start_date is None else start_date
+    df_close = df.select(pl.col(group_by), pl.col("Date"), pl.col("Close"))
+
+    df_windows = (
+        df_close.with_columns(pl.lit(periods).alias("Period"))
+        .explode("Period")
+        .with_columns(
+            pl.col("Date").dt.offset_by(pl.col("Period")).alias("_upper_boundary")
         )
-        end_date = (
-            df.select(pl.col("Date").max()).item() if end_date is None else end_date
+        .filter(pl.col("_upper_boundary") <= end_date)
+        # Windows are closed on the left, so they end on the day before the upper boundary.
+        .with_columns((pl.col("_upper_boundary") - pl.duration(days=1)).alias("_end"))
+        .sort("_end")
+        .join_asof(
+            df_close.select(
+                pl.col(group_by),
+                pl.col("Date").alias("End Date"),
+                pl.col("Close").alias("End Close"),
+            ).sort("End Date"),
+            left_on="_end",
+            right_on="End Date",
+            by=group_by,
+            strategy="backward",
+            check_sortedness=False,
         )
-
-        sip_data.append(
-            build_sip(df, inv_amount, step_up, start_date, end_date).with_columns(
-                pl.col("Index Name"),
-            )
+        .with_columns(
+            (
+                (pl.col("End Close") / pl.col("Close")).pow(
+                    1
+                    / (
+                        (pl.col("End Date") - pl.col("Date"))
+                        / pl.duration(hours=8766)  # 1 year in hours
+                    )
+                )
+                - 1
+            ).alias("Return"),
         )
+    )
+
+    df_summary = df_windows.group_by(group_by, "Period").agg(
+        pl.col("Return").min().alias("Min Return"),
+        pl.col("Return").quantile(0.25).alias("25% Quantile"),
+        pl.col("Return").median().alias("Median Return"),
+        pl.col("Return").quantile(0.75).alias("75% Quantile"),
+        pl.col("Return").max().alias("Max Return"),
+    )
+    summary_columns = [
+        "Min Return",
+        "25% Quantile",
+        "Median Return",
+        "75% Quantile",
+        "Max Return",
+    ]
+
+    return {
+        period: df_summary.filter(pl.col("Period") == period)
+        .drop("Period")
+        .rename({c: f"{period} {c}" for c in summary_columns})
+        .sort(group_by)
+        for period in periods
+    }
+
 
-    if start_date is None or end_date is None:
+def get_rolling_returns(
+    df: pl.DataFrame,
+    start_date: date,
+    end_date: date,
+    period: str = "1y",
+    group_by: str = "Index Name",
+) -> pl.DataFrame:
+    """
+    Calculate rolling returns for a given period and group by specified column.
+    """
+
+    return get_rolling_returns_multi(
+        df, start_date, end_date, periods=[period], group_by=group_by
+    )[period]
+
+
+if __name__ == "__main__":
+    rebuild_cache = "--rebuild-cache" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--rebuild-cache"]
+    inv_amount = 10_000 if len(args) < 1 else float(args[0])
+    step_up = 0.10 if len(args) < 2 else float(args[1])
+
+    paths = sorted(pathlib.Path().glob(PATH))
+    if not paths:
         raise ValueError("No data found in the specified path.")
+    for path in paths:
+        print(f"Processing {path}")
 
-    df_sip = pl.concat(sip_data).sort("Date")
-    df_raw = pl.concat(raw_data).sort("Date")
+    # All the files are read by a single scan. The SIP dates are built once for all the indices, and everything else
+    # is a single lazy query plan collected once at the end.
+    df_prices = scan_indices(paths, rebuild=rebuild_cache).sort("Date").collect()
+
+    # All the files are expected to use the same start/end date.
+    start_date = df_prices["Date"].min()
+    end_date = df_prices["Date"].max()
+
+    df_sip = build_sip(df_prices, inv_amount, step_up, start_date, end_date).lazy()
+    df_raw = df_prices.lazy()
 
     df_latest = df_raw.group_by("Index Name").agg(
         pl.col("Close").last().alias("Latest Close"),
@@ -201,20 +487,13 @@ if __name__ == "__main__":
                 ),
                 df_sip_total.select(
                     pl.col("Index Name"),
-                    pl.lit(df_sip_total["End Date"]).alias("date"),
+                    pl.col("End Date").alias("date"),
                     pl.col("Final Value").alias("amount"),
                 ),
             ]
         )
         .group_by("Index Name")
-        .agg(
-            pl.struct(["date", "amount"])
-            .map_batches(
-                xirr,
-                returns_scalar=True,
-            )
-            .alias("xirr")
-        )
+        .agg(pl.col("amount").fin.xirr("date").alias("xirr"))
     )
 
     df_sip_total = (
@@ -235,16 +514,16 @@ if __name__ == "__main__":
 
     df_rollings = df_raw
 
-    df_rolling_1y = get_rolling_returns(
-        df_rollings, start_date, end_date, period="1y", group_by="Index Name"
-    )
-
-    df_rolling_2y = get_rolling_returns(
-        df_rollings, start_date, end_date, period="2y", group_by="Index Name"
-    )
+    df_rolling_1y, df_rolling_2y, df_rolling_5y = get_rolling_returns_multi(
+        df_rollings,
+        start_date,
+        end_date,
+        periods=["1y", "2y", "5y"],
+        group_by="Index Name",
+    ).values()
 
-    df_rolling_5y = get_rolling_returns(
-        df_rollings, start_date, end_date, period="5y", group_by="Index Name"
+    df_sip_total, df_rolling_1y, df_rolling_2y, df_rolling_5y = pl.collect_all(
+        [df_sip_total, df_rolling_1y, df_rolling_2y, df_rolling_5y]
     )
 
     with pl.Config(
@@ -0,0 +1,259 @@
+import datetime
+import pathlib
+from typing import Iterable
+
+import polars as pl
+
+from navstore import NavStore
+
+RETURN_STORE_DIR = "returnstore"
+
+RETURN_SCHEMA = pl.Schema(
+    {
+        "scheme_code": pl.String(),
+        "date": pl.Date(),
+        "nav": pl.Float64(),
+        # log(nav / previous nav), null on the first NAV of a scheme
+        "log_return": pl.Float64(),
+        # Growth of 1 invested on the first NAV of a scheme
+        "factor": pl.Float64(),
+        # Highest factor so far
+        "peak": pl.Float64(),
+        # factor / peak - 1, the current fall from the peak
+        "drawdown": pl.Float64(),
+        # Lowest drawdown so far
+        "max_drawdown": pl.Float64(),
+    }
+)
+
+# Dates without a NAV (weekends, holidays) take the last NAV of at most this many days before
+LOOKBACK_DAYS = 10
+
+
+class ReturnStore(NavStore):
+    """
+    Daily returns derived from the NAV store, stored with the same monthly layout as NavStore (see RETURN_SCHEMA).
+
+    The return of a scheme between two dates is the ratio of their cumulative factors, so period returns, CAGRs and
+    rolling returns are lookups of two rows per scheme instead of a pass over the NAVs in between.
+
+    `update` only computes the rows of new NAVs, continuing from the last row of each scheme, which is kept in
+    `<root>/latest.parquet`. New NAVs older than the latest row of a scheme (a backfill or a revision) recompute the
+    scheme from the first new date onwards.
+
+    Example:
+    >>> returns = ReturnStore()
+    >>> returns.update(df_new)
+    >>> period_returns(datetime.date(2020, 1, 1), datetime.date(2025, 1, 1), ["119551"])
+    """
+
+    schema = RETURN_SCHEMA
+
+    def __init__(self, root: str | pathlib.Path = RETURN_STORE_DIR):
+        super().__init__(root)
+        self.latest_path = self.root / "latest.parquet"
+
+    def latest(self) -> pl.DataFrame:
+        """
+        The last row of each scheme.
+        """
+        if not self.latest_path.exists():
+            return pl.DataFrame(schema=RETURN_SCHEMA)
+        return pl.read_parquet(self.latest_path)
+
+    def _state(self, df_from: pl.DataFrame) -> pl.DataFrame:
+        """
+        The last row of each scheme before its first new date, as the state to continue from.
+        """
+        df_latest = self.latest().join(df_from, on="scheme_code")
+        df_state = df_latest.filter(pl.col("date") < pl.col("_from"))
+        # Schemes with new NAVs before their latest row are looked up in the store
+        df_older = df_latest.filter(pl.col("date") >= pl.col("_from"))
+        if not df_older.is_empty():
+            df_state = pl.concat(
+                [
+                    df_state,
+                    self.scan(df_older["scheme_code"].to_list())
+                    .join(
+                        df_older.lazy().select("scheme_code", "_from"),
+                        on="scheme_code",
+                    )
+                    .filter(pl.col("date") < pl.col("_from"))
+                    .group_by("scheme_code")
+                    .agg(pl.all().sort_by("date").last())
+                    .collect(),
+                ],
+                how="diagonal",
+            )
+        return df_state.select(
+            pl.col("scheme_code"),
+            pl.col("nav").alias("_prev_nav"),
+            # NAV at which the factor is 1
+            (pl.col("nav") / pl.col("factor")).alias("_base"),
+            pl.col("peak").alias("_peak"),
+            pl.col("max_drawdown").alias("_max_drawdown"),
+        )
+
+    def update(
+        self, df_new: pl.DataFrame | pl.LazyFrame, navs: NavStore | None = None
+    ):
+        """
+        Compute the rows of new NAVs, after they have been written to the NAV store.
+
+        Args:
+            df_new (pl.DataFrame | pl.LazyFrame): The new NAVs, with at least the columns 'scheme_code' and 'date'.
+                   Pass the whole NAV history (e.g. NavStore().scan()) to build the store from scratch.
+            navs (NavStore | None): The NAV store to read the NAVs from. If None, the default NavStore.
+        """
+        navs = navs or NavStore()
+        df_from = (
+            df_new.lazy()
+            .group_by("scheme_code")
+            .agg(pl.col("date").min().alias("_from"))
+            .collect()
+        )
+        if df_from.is_empty():
+            return
+        df_state = self._state(df_from)
+
+        # Each scheme continues from its state. New schemes have no state and start with a factor of 1.
+        previous_nav = pl.col("nav").shift(1).over("scheme_code")
+        first_nav = pl.col("nav").first().over("scheme_code")
+        df = (
+            navs.scan(df_from["scheme_code"].to_list(), start=df_from["_from"].min())
+            .select("scheme_code", "date", pl.col("nav").cast(pl.Float64))
+            .join(df_from.lazy(), on="scheme_code")
+            .filter(pl.col("date") >= pl.col("_from"))
+            .join(df_state.lazy(), on="scheme_code", how="left")
+            .sort("scheme_code", "date")
+            .with_columns(
+                (pl.col("nav") / previous_nav.fill_null(pl.col("_prev_nav")))
+                .log()
+                .alias("log_return"),
+                (pl.col("nav") / pl.col("_base").fill_null(first_nav)).alias("factor"),
+            )
+            .with_columns(
+                pl.max_horizontal(
+                    pl.col("factor").cum_max().over("scheme_code"), pl.col("_peak")
+                ).alias("peak")
+            )
+            .with_columns((pl.col("factor") / pl.col("peak") - 1).alias("drawdown"))
+            .with_columns(
+                pl.min_horizontal(
+                    pl.col("drawdown").cum_min().over("scheme_code"),
+                    pl.col("_max_drawdown"),
+                ).alias("max_drawdown")
+            )
+            .select(RETURN_SCHEMA.names())
+            .collect()
+        )
+        if df.is_empty():
+            return
+        self.upsert(df)
+
+        # The rows of each scheme were computed up to its last NAV, so its last row is the latest
+        df_latest = pl.concat(
+            [self.latest(), df.group_by("scheme_code").agg(pl.all().last())],
+            how="diagonal",
+        ).unique(subset="scheme_code", keep="last", maintain_order=True)
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.latest_path.with_suffix(".tmp")
+        df_latest.sort("scheme_code").write_parquet(tmp_path)
+        tmp_path.replace(self.latest_path)
+
+
+def factors_on(
+    date: datetime.date,
+    schemes: Iterable[str] | None = None,
+    store: ReturnStore | None = None,
+) -> pl.LazyFrame:
+    """
+    The cumulative factor of each scheme on a date, or on its last NAV date in the LOOKBACK_DAYS days before.
+
+    Returns:
+        pl.LazyFrame: The columns 'scheme_code', 'date' (of the NAV) and 'factor'.
+    """
+    store = store or ReturnStore()
+    return (
+        store.scan(schemes, date - datetime.timedelta(days=LOOKBACK_DAYS), date)
+        .group_by("scheme_code")
+        .agg(pl.col("date", "factor").sort_by("date").last())
+    )
+
+
+def period_returns(
+    start: datetime.date,
+    end: datetime.date,
+    schemes: Iterable[str] | None = None,
+    store: ReturnStore | None = None,
+) -> pl.DataFrame:
+    """
+    The return of each scheme between two dates, from its factors on both dates.
+
+    Returns:
+        pl.DataFrame: The columns 'scheme_code', 'start_date' and 'end_date' (of the NAVs used), 'return' and 'cagr'
+                   (annualized over 365.25 days). Schemes without a NAV near both dates are left out.
+    """
+    schemes = None if schemes is None else list(schemes)
+    store = store or ReturnStore()
+    df_start = factors_on(start, schemes, store).rename(
+        {"date": "start_date", "factor": "_start"}
+    )
+    df_end = factors_on(end, schemes, store).rename(
+        {"date": "end_date", "factor": "_end"}
+    )
+    years = (pl.col("end_date") - pl.col("start_date")).dt.total_days() / 365.25
+    return (
+        df_start.join(df_end, on="scheme_code")
+        .select(
+            "scheme_code",
+            "start_date",
+            "end_date",
+            (pl.col("_end") / pl.col("_start") - 1).alias("return"),
+            ((pl.col("_end") / pl.col("_start")).pow(1 / years) - 1).alias("cagr"),
+        )
+        .sort("scheme_code")
+        .collect()
+    )
+
+
+def rolling_returns(
+    years: int,
+    start: datetime.date,
+    end: datetime.date,
+    schemes: Iterable[str] | None = None,
+    store: ReturnStore | None = None,
+) -> pl.DataFrame:
+    """
+    The annualized return over the previous `years` years of each scheme, on each of its NAV dates between start and
+    end.
+
+    Returns:
+        pl.DataFrame: The columns 'scheme_code', 'date' and 'cagr', null when there is no NAV `years` years before.
+    """
+    schemes = None if schemes is None else list(schemes)
+    store = store or ReturnStore()
+    first = start - datetime.timedelta(days=366 * years + LOOKBACK_DAYS)
+    df = store.scan(schemes, first, end).select("scheme_code", "date", "factor")
+    return (
+        df.filter(pl.col("date") >= start)
+        .with_columns(pl.col("date").dt.offset_by(f"-{years}y").alias("_then"))
+        .sort("_then")
+        .join_asof(
+            df.sort("date").rename({"date": "_then", "factor": "_factor_then"}),
+            on="_then",
+            by="scheme_code",
+            strategy="backward",
+            tolerance=datetime.timedelta(days=LOOKBACK_DAYS),
+            check_sortedness=False,
+        )
+        .select(
+            "scheme_code",
+            "date",
+            ((pl.col("factor") / pl.col("_factor_then")).pow(1 / years) - 1).alias(
+                "cagr"
+            ),
+        )
+        .sort("scheme_code", "date")
+        .collect()
+    )
@@ -0,0 +1,174 @@
+import datetime
+import functools
+import pathlib
+import warnings
+from typing import Iterable
+
+import numpy as np
+import polars as pl
+
+HOLIDAYS_PATH = pathlib.Path(__file__).with_name("holidays.csv")
+
+# Range of dates covered by the calendar
+FIRST_DAY = datetime.date(1980, 1, 1)
+LAST_DAY = datetime.date(2099, 12, 31)
+
+
+class TradingCalendar:
+    """
+    Trading days between FIRST_DAY and LAST_DAY: weekdays which are not holidays.
+
+    The trading days are computed once into a sorted array, `days`, so that finding the next or previous trading day
+    of a date or counting the trading days between two dates is a binary search. `holidays` can be passed to the
+    business day functions of Polars (`is_business_day`, `add_business_days`, `business_day_count`) to use the same
+    calendar in expressions.
+
+    Use load_calendar to get the calendar with the holidays of holidays.csv. The holidays are only known for the
+    years of `years` (all of them when None): a warning is issued the first time the calendar is asked about a date
+    outside of them, where exchange holidays are treated as trading days.
+
+    Example:
+    >>> calendar = load_calendar()
+    >>> calendar.next_trading_day(datetime.date(2025, 3, 14))
+    datetime.date(2025, 3, 17)
+    """
+
+    def __init__(
+        self,
+        holidays: Iterable[datetime.date] = (),
+        years: tuple[int, int] | None = None,
+    ):
+        self.holidays = sorted(set(holidays))
+        self.years = years
+        self._warned = False
+        days = np.arange(np.datetime64(FIRST_DAY), np.datetime64(LAST_DAY) + 1)
+        self.days = days[
+            np.is_busday(days, holidays=np.array(self.holidays, dtype="datetime64[D]"))
+        ]
+
+    def positions(self, dates, roll: str = "forward") -> np.ndarray:
+        """
+        Find the positions in `days` of the trading days on or after (roll="forward") or on or before
+        (roll="backward") the given dates.
+
+        Args:
+            dates: A date, or an array or pl.Series of dates.
+            roll (str): "forward" or "backward".
+
+        Returns:
+            np.ndarray: The positions, of the same shape as dates. They are len(days) or -1 for dates after or before
+                   the calendar.
+        """
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        self._check_years(dates)
+        if roll == "forward":
+            return np.searchsorted(self.days, dates, side="left")
+        if roll == "backward":
+            return np.searchsorted(self.days, dates, side="right") - 1
+        raise ValueError(f"roll must be 'forward' or 'backward', got {roll!r}")
+
+    def _check_years(self, dates: np.ndarray):
+        if self.years is None or self._warned or dates.size == 0:
+            return
+        first_year, last_year = self.years
+        first = np.datetime64(datetime.date(first_year, 1, 1))
+        last = np.datetime64(datetime.date(last_year, 12, 31))
+        if np.nanmin(dates) < first or np.nanmax(dates) > last:
+            self._warned = True
+            warnings.warn(
+                f"The trading calendar only has the holidays of {first_year} to {last_year}, holidays of other "
+                "years are treated as trading days. Add them to holidays.csv.",
+                stacklevel=3,
+            )
+
+    def _date(self, position: int) -> datetime.date:
+        if not 0 <= position < len(self.days):
+            raise ValueError(
+                f"Date outside of the trading calendar ({FIRST_DAY} to {LAST_DAY})"
+            )
+        return self.days[position].item()
+
+    def is_trading_day(self, date: datetime.date) -> bool:
+        position = int(self.positions(date))
+        return position < len(self.days) and self.days[position] == np.datetime64(date)
+
+    def next_trading_day(
+        self, date: datetime.date, strict: bool = False
+    ) -> datetime.date:
+        """
+        The first trading day on or after date, or strictly after it if strict is True.
+        """
+        if strict:
+            date += datetime.timedelta(days=1)
+        return self._date(int(self.positions(date, "forward")))
+
+    def previous_trading_day(
+        self, date: datetime.date, strict: bool = False
+    ) -> datetime.date:
+        """
+        The last trading day on or before date, or strictly before it if strict is True.
+        """
+        if strict:
+            date -= datetime.timedelta(days=1)
+        return self._date(int(self.positions(date, "backward")))
+
+    def offset(self, date: datetime.date, n: int) -> datetime.date:
+        """
+        The trading day n trading days after date (before it if n is negative). A date which is not a trading day is
+        first rolled forward to the next trading day.
+        """
+        return self._date(int(self.positions(date, "forward")) + n)
+
+    def count(self, start_date: datetime.date, end_date: datetime.date) -> int:
+        """
+        The number of trading days between start_date and end_date, both included.
+        """
+        start = int(self.positions(start_date, "forward"))
+        end = int(self.positions(end_date, "backward"))
+        return max(end - start + 1, 0)
+
+    def trading_days(
+        self, start_date: datetime.date, end_date: datetime.date
+    ) -> pl.Series:
+        """
+        The trading days between start_date and end_date, both included, as a 'date' Series.
+        """
+        start = int(self.positions(start_date, "forward"))
+        end = int(self.positions(end_date, "backward"))
+        return pl.Series("date", self.days[start : max(end + 1, start)])
+
+    def buckets(
+        self, start_date: datetime.date, end_date: datetime.date, every: str = "1mo"
+    ) -> pl.DataFrame:
+        """
+        Group the trading days between start_date and end_date into periods, e.g. "1mo" or "1w".
+
+        Returns:
+            pl.DataFrame: One row per period with its first trading day 'start_date', last trading day 'end_date' and
+                   number of trading days 'count'.
+        """
+        return (
+            self.trading_days(start_date, end_date)
+            .to_frame()
+            .group_by_dynamic("date", every=every)
+            .agg(
+                pl.col("date").first().alias("start_date"),
+                pl.col("date").last().alias("end_date"),
+                pl.len().alias("count"),
+            )
+            .drop("date")
+        )
+
+
+@functools.cache
+def load_calendar(path: str | pathlib.Path = HOLIDAYS_PATH) -> TradingCalendar:
+    """
+    Load the trading calendar with the holidays listed in a CSV file with the columns 'date' and 'description'.
+
+    The file is taken to cover every year from the first to the last year of its holidays, see TradingCalendar.
+
+    The calendar of each file is only built once.
+    """
+    holidays = pl.read_csv(path, comment_prefix="#", try_parse_dates=True)["date"]
+    years = (holidays.min().year, holidays.max().year) if len(holidays) else None
+    return TradingCalendar(holidays.to_list(), years)
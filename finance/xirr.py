@@ -1,7 +1,89 @@
+import warnings
+
+import numpy as np
 import polars as pl
 from scipy import optimize
 
 
+class CashFlows:
+    """
+    A series of cash flows prepared for repeated NPV evaluations.
+
+    The year fractions and amounts are computed once and stored as contiguous float64 arrays, so that evaluating the
+    NPV (or its derivative) for a new rate is a plain NumPy operation instead of a new Polars query. Root finders
+    call these methods dozens of times per series of cash flows.
+
+    Attributes:
+        t (np.ndarray): Time of each cash flow in years from the first cash flow (difference in days / 365).
+        amount (np.ndarray): Amount of each cash flow.
+
+    Example:
+    >>> df = pl.DataFrame(
+    ...     {"date": ["2023-01-01", "2023-02-01", "2023-03-01"], "amount": [1000, 1500, 2000]}
+    ... )
+    >>> df = df.with_columns(pl.col("date").cast(pl.Date()))
+    >>> cf = CashFlows.from_frame(df)
+    >>> cf.npv(0.1)
+    4457.33029053319
+    """
+
+    def __init__(self, t: np.ndarray, amount: np.ndarray):
+        self.t = np.ascontiguousarray(t, dtype=np.float64)
+        self.amount = np.ascontiguousarray(amount, dtype=np.float64)
+        self._neg_t = -self.t
+        self._neg_t_amount = self._neg_t * self.amount
+
+    @classmethod
+    def from_frame(cls, df: pl.Series | pl.DataFrame) -> "CashFlows":
+        """
+        Prepare the cash flows from a Polars Series or DataFrame.
+
+        Args:
+            df (pl.Series | pl.DataFrame): A Polars Series or DataFrame containing the cash flows. The series should
+                       be a struct with two fields: 'date' and 'amount' in this order. The DataFrame should have two
+                       columns: 'date' and 'amount'. Rows with a null date or amount are ignored.
+
+        Returns:
+            CashFlows: The prepared cash flows.
+
+        Raises:
+            ValueError: If the input is not a Polars Series or DataFrame.
+        """
+        if isinstance(df, pl.Series):
+            df = df.struct.rename_fields(["date", "amount"]).struct.unnest()
+        elif isinstance(df, pl.DataFrame):
+            df = df.select(pl.col("date"), pl.col("amount"))
+        else:
+            raise ValueError("Input must be a Polars Series or DataFrame.")
+        df = df.select(
+            ((pl.col("date") - pl.col("date").min()) / pl.duration(days=365))
+            .cast(pl.Float64)
+            .alias("t"),
+            pl.col("amount").cast(pl.Float64),
+        ).drop_nulls()
+        return cls(df["t"].to_numpy(), df["amount"].to_numpy())
+
+    def npv(self, rate: float) -> float:
+        """
+        Calculate the NPV of the cash flows at the given rate. The NPV is NaN for rates of -100% or less.
+        """
+        if rate <= -1:
+            return np.nan
+        with np.errstate(over="ignore"):
+            return float(np.dot(self.amount, np.power(1 + rate, self._neg_t)))
+
+    def dnpv(self, rate: float) -> float:
+        """
+        Calculate the derivative of the NPV with respect to the rate. The derivative is NaN for rates of -100% or less.
+        """
+        if rate <= -1:
+            return np.nan
+        with np.errstate(over="ignore"):
+            return float(
+                np.dot(self._neg_t_amount, np.power(1 + rate, self._neg_t - 1))
+            )
+
+
 def xnpv(rate: float, df: pl.DataFrame) -> float:
     """
     Calculate the net present value (NPV) of a series of cash flows.
@@ -17,7 +99,8 @@ def xnpv(rate: float, df: pl.DataFrame) -> float:
     The time period is calculated as the difference between the cash flow date and the minimum date in the DataFrame,
     divided by the number of days in a year (365).
 
-    This function is designed to be called by the xirr function to calculate the IRR.
+    This function prepares the cash flows on every call. To evaluate the NPV for many rates, prepare the cash flows
+    once with `CashFlows.from_frame` and call its `npv` method instead.
 
     Args:
         rate (float): The discount rate.
@@ -35,21 +118,88 @@ def xnpv(rate: float, df: pl.DataFrame) -> float:
     >>> xnpv(0.1, df)
     4457.33029053319
     """
-    return df.select(
-        (
-            pl.col("amount")
-            / (pl.lit(1 + rate)).pow(
-                (pl.col("date") - pl.col("date").min()) / pl.duration(days=365)
-            )
-        ).sum(),
-    ).item()
+    return CashFlows.from_frame(df).npv(rate)
+
+
+def xnpv_prime(rate: float, df: pl.DataFrame) -> float:
+    """
+    Calculate the derivative of the net present value (NPV) with respect to the discount rate.
+
+    The derivative is calculated using the formula:
+    dNPV/dr = sum(-t * CF / (1 + r)^(t + 1))
+
+    where CF, r and t are the same as in `xnpv`.
+
+    This function prepares the cash flows on every call. To evaluate the derivative for many rates, prepare the cash
+    flows once with `CashFlows.from_frame` and call its `dnpv` method instead.
+
+    Args:
+        rate (float): The discount rate.
+        df (pl.DataFrame): A Polars DataFrame containing the cash flows. The DataFrame should have two columns:
+                       'date' and 'amount'.
+
+    Returns:
+        float: The derivative of the NPV of the cash flows at the given rate.
+
+    Example:
+    >>> df = pl.DataFrame(
+    ...     {"date": ["2023-01-01", "2023-02-01", "2023-03-01"], "amount": [1000, 1500, 2000]}
+    ... )
+    >>> df = df.with_columns(pl.col("date").cast(pl.Date()))
+    >>> xnpv_prime(0.1, df)
+    -404.28666987470797
+    """
+    return CashFlows.from_frame(df).dnpv(rate)
+
+
+# Candidate rates used to look for a sign change of the NPV when Newton-Raphson fails.
+BRACKET_GRID = (
+    -0.9999,
+    -0.999,
+    -0.99,
+    -0.9,
+    -0.75,
+    -0.5,
+    -0.25,
+    0.0,
+    0.25,
+    0.5,
+    1.0,
+    2.0,
+    5.0,
+    10.0,
+    100.0,
+)
 
 
-def xirr(df: pl.Series | pl.DataFrame, guess=0.1) -> float:
+def _find_bracket(f, guess: float) -> tuple[float, float] | None:
+    """
+    Find an interval [a, b] on BRACKET_GRID over which f changes sign, preferring the one closest to the guess.
+    """
+    values = [(r, f(r)) for r in BRACKET_GRID]
+    brackets = [
+        (a, b)
+        for (a, fa), (b, fb) in zip(values, values[1:])
+        if np.isfinite(fa) and np.isfinite(fb) and np.sign(fa) != np.sign(fb)
+    ]
+    if not brackets:
+        return None
+    return min(brackets, key=lambda ab: abs((ab[0] + ab[1]) / 2 - guess))
+
+
+def xirr(
+    df: pl.Series | pl.DataFrame,
+    guess=0.1,
+    tol: float = 1.48e-8,
+    maxiter: int = 50,
+    full_output: bool = False,
+) -> float | tuple[float, int]:
     """
     Calculate the internal rate of return (IRR) for a series of cash flows.
 
-    The IRR is calculated using the Newton-Raphson method to find the root of the NPV function.
+    The IRR is calculated using the Newton-Raphson method (with the analytic derivative of the NPV) to find the root
+    of the NPV function. If Newton-Raphson does not converge, for instance for SIPs with large negative returns, the
+    root is searched again using Brent's method over an interval where the NPV changes sign.
 
     This function can also be used with the polars map_batches function to calculate the IRR for each group in a DataFrame. This allows,
     for instance, to calculate the IRR for different assets in a portfolio.
@@ -59,12 +209,17 @@ def xirr(df: pl.Series | pl.DataFrame, guess=0.1) -> float:
                    two fields: 'date' and 'amount' in this order. The DataFrame should have two columns:
                    'date' and 'amount'.
         guess (float): An initial guess for the IRR. Default is 0.1 (10%).
+        tol (float): Absolute tolerance on the IRR. Default matches scipy.optimize.newton.
+        maxiter (int): Maximum number of iterations for each of the two methods.
+        full_output (bool): If True, also return the total number of iterations used by the solver.
 
     Returns:
-        float: The calculated IRR.
+        float | tuple[float, int]: The calculated IRR, or a tuple of the IRR and the number of iterations if
+                   `full_output` is True.
 
     Raises:
         ValueError: If the input is not a Polars Series or DataFrame.
+        RuntimeError: If the IRR could not be found by either method.
 
     Example:
     >>> df = pl.DataFrame(
@@ -72,19 +227,358 @@ def xirr(df: pl.Series | pl.DataFrame, guess=0.1) -> float:
     ... )
     >>> df = df.with_columns(pl.col("date").cast(pl.Date()))
     >>> xirr(df)
-    0.0.11369105297634706
-    """
-    if isinstance(df, pl.Series):
-        df = df.struct.rename_fields(["date", "amount"]).struct.unnest()
-    elif isinstance(df, pl.DataFrame):
-        df = df.select(pl.col("date"), pl.col("amount"))
-    else:
-        raise ValueError("Input must be a Polars Series or DataFrame.")
-    df = df.with_columns(
-        pl.col("date").cast(pl.Date()),
-        pl.col("amount").cast(pl.Float64),
+    4.085285795132018
+    >>> xirr(df, full_output=True)
+    (4.085285795132018, 7)
+    """
+    cf = CashFlows.from_frame(df)
+
+    with warnings.catch_warnings():
+        # A failed Newton-Raphson run is handled by the fallback below.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        rate, result = optimize.newton(
+            cf.npv,
+            guess,
+            fprime=cf.dnpv,
+            tol=tol,
+            maxiter=maxiter,
+            full_output=True,
+            disp=False,
+        )
+    iterations = result.iterations
+
+    if not (result.converged and np.isfinite(rate) and rate > -1):
+        bracket = _find_bracket(cf.npv, guess)
+        if bracket is None:
+            raise RuntimeError(
+                f"Failed to converge after {iterations} iterations and no bracket was found."
+            )
+        rate, result = optimize.brentq(
+            cf.npv, *bracket, xtol=tol, maxiter=maxiter, full_output=True, disp=False
+        )
+        iterations += result.iterations
+        if not result.converged:
+            raise RuntimeError(f"Failed to converge after {iterations} iterations.")
+
+    rate = float(rate)
+    return (rate, iterations) if full_output else rate
+
+
+def _halley_batch(
+    t: np.ndarray,
+    amount: np.ndarray,
+    group_idx: np.ndarray,
+    n_groups: int,
+    guess: float = 0.1,
+    tol: float = 1.48e-8,
+    maxiter: int = 50,
+) -> np.ndarray:
+    """
+    Solve NPV(r) = 0 for every group at once using vectorized Halley iterations.
+
+    Each iteration evaluates the NPV and its first two derivatives for all the groups which have not converged yet
+    using a single pass over the cash flows. Groups drop out of the active mask as soon as their step is smaller
+    than `tol`. Groups which do not converge within `maxiter` iterations, or whose derivative vanishes, are NaN.
+
+    Args:
+        t (np.ndarray): Year fraction of each cash flow from the first cash flow of its group.
+        amount (np.ndarray): Amount of each cash flow.
+        group_idx (np.ndarray): Index of the group (0 to n_groups - 1) of each cash flow.
+        n_groups (int): Number of groups.
+        guess (float): An initial guess for the IRR of every group. Default is 0.1 (10%).
+        tol (float): Absolute tolerance on the step size. Default matches scipy.optimize.newton.
+        maxiter (int): Maximum number of iterations for each group.
+
+    Returns:
+        np.ndarray: The IRR of each group.
+    """
+    rate = np.full(n_groups, guess, dtype=np.float64)
+    result = np.full(n_groups, np.nan, dtype=np.float64)
+    active = np.ones(n_groups, dtype=bool)
+
+    for _ in range(maxiter):
+        rows = active[group_idx]
+        if not rows.any():
+            break
+        g, tt, amt = group_idx[rows], t[rows], amount[rows]
+
+        # Diverging groups overflow to inf/NaN, which is handled below.
+        with np.errstate(all="ignore"):
+            base = 1 + rate[g]
+            pv = amt * base ** (-tt)
+            f = np.bincount(g, weights=pv, minlength=n_groups)
+            fp = np.bincount(g, weights=-tt * pv / base, minlength=n_groups)
+            fpp = np.bincount(
+                g, weights=tt * (tt + 1) * pv / base**2, minlength=n_groups
+            )
+            newton_step = f / fp
+            adj = newton_step * fpp / fp / 2
+            step = np.where(np.abs(adj) < 1, newton_step / (1 - adj), newton_step)
+
+        # Groups with a vanishing derivative or a non-finite step cannot make progress.
+        failed = active & ~np.isfinite(step)
+        active &= ~failed
+
+        new_rate = rate - np.where(active, step, 0)
+        # Keep (1 + r) positive by moving halfway towards -1 instead of jumping past it.
+        new_rate = np.where(new_rate <= -1, (rate - 1) / 2, new_rate)
+
+        converged = active & (np.abs(step) < tol)
+        result[converged] = new_rate[converged]
+        active &= ~converged
+        rate = new_rate
+
+    return result
+
+
+def _bisect_batch(
+    t: np.ndarray,
+    amount: np.ndarray,
+    group_idx: np.ndarray,
+    n_groups: int,
+    todo: np.ndarray,
+    guess: float = 0.1,
+    tol: float = 1.48e-8,
+    maxiter: int = 50,
+) -> np.ndarray:
+    """
+    Solve NPV(r) = 0 for the groups in `todo` using vectorized bisection.
+
+    This is the batch counterpart of the bracketed fallback in `xirr`: the NPV of every group is evaluated on
+    BRACKET_GRID, the sign-changing interval closest to the guess is picked, and all the intervals are halved together
+    until they are narrower than `tol`. Groups without a sign change, or still wider than `tol` after `maxiter`
+    iterations, are NaN.
+
+    Args:
+        t (np.ndarray): Year fraction of each cash flow from the first cash flow of its group.
+        amount (np.ndarray): Amount of each cash flow.
+        group_idx (np.ndarray): Index of the group (0 to n_groups - 1) of each cash flow.
+        n_groups (int): Number of groups.
+        todo (np.ndarray): Boolean mask of the groups to solve.
+        guess (float): The initial guess, used to choose between several brackets.
+        tol (float): Absolute tolerance on the IRR.
+        maxiter (int): Maximum number of bisection iterations.
+
+    Returns:
+        np.ndarray: The IRR of each group in `todo` and NaN for the others.
+    """
+    result = np.full(n_groups, np.nan, dtype=np.float64)
+    rows = todo[group_idx]
+    if not rows.any():
+        return result
+    g, tt, amt = group_idx[rows], t[rows], amount[rows]
+
+    def npv(rate: np.ndarray) -> np.ndarray:
+        with np.errstate(all="ignore"):
+            return np.bincount(g, weights=amt * (1 + rate[g]) ** (-tt), minlength=n_groups)
+
+    grid = np.asarray(BRACKET_GRID)
+    values = np.stack([npv(np.full(n_groups, r)) for r in grid])
+    lows, highs = values[:-1], values[1:]
+    changes = np.isfinite(lows) & np.isfinite(highs) & (np.sign(lows) != np.sign(highs))
+    distance = np.abs((grid[:-1] + grid[1:]) / 2 - guess)[:, None]
+    choice = np.where(changes, distance, np.inf).argmin(axis=0)
+    found = todo & changes[choice, np.arange(n_groups)]
+
+    a, b = grid[choice], grid[choice + 1]
+    fa = lows[choice, np.arange(n_groups)]
+    for _ in range(maxiter):
+        mid = (a + b) / 2
+        fm = npv(mid)
+        left = np.sign(fm) == np.sign(fa)
+        a, fa = np.where(left, mid, a), np.where(left, fm, fa)
+        b = np.where(left, b, mid)
+        if np.all(b - a < tol):
+            break
+
+    converged = found & (b - a < tol)
+    result[converged] = ((a + b) / 2)[converged]
+    return result
+
+
+def xirr_batch(
+    df: pl.DataFrame,
+    group_by: str = "group",
+    guess: float = 0.1,
+    tol: float = 1.48e-8,
+    maxiter: int = 50,
+) -> pl.DataFrame:
+    """
+    Calculate the internal rate of return (IRR) for many groups of cash flows at once.
+
+    Instead of calling `xirr` once per group, all the groups are solved together using vectorized Halley iterations
+    over NumPy arrays. This is much faster when there are thousands of groups (for instance, portfolios or schemes).
+    Like `xirr`, groups for which Halley's method does not converge are solved again by bisection over an interval
+    where the NPV changes sign. Groups which still do not converge within `maxiter` iterations get a NaN IRR.
+
+    Args:
+        df (pl.DataFrame): A Polars DataFrame in long format with the columns `group_by`, 'date' and 'amount'.
+        group_by (str): Name of the column identifying each group. Default is 'group'.
+        guess (float): An initial guess for the IRR of every group. Default is 0.1 (10%).
+        tol (float): Absolute tolerance on the IRR. Default matches scipy.optimize.newton.
+        maxiter (int): Maximum number of iterations for each group.
+
+    Returns:
+        pl.DataFrame: A DataFrame with the columns `group_by` and 'xirr', one row per group in order of appearance.
+
+    Example:
+    >>> df = pl.DataFrame(
+    ...     {
+    ...         "group": ["A", "A", "A", "B", "B"],
+    ...         "date": ["2023-01-01", "2023-02-01", "2023-03-01", "2023-01-01", "2024-01-01"],
+    ...         "amount": [1000, 1500, -3000, 1000, -1100],
+    ...     }
+    ... )
+    >>> df = df.with_columns(pl.col("date").cast(pl.Date()))
+    >>> xirr_batch(df)
+    shape: (2, 2)
+    ┌───────┬──────────┐
+    │ group ┆ xirr     │
+    │ ---   ┆ ---      │
+    │ str   ┆ f64      │
+    ╞═══════╪══════════╡
+    │ A     ┆ 4.085286 │
+    │ B     ┆ 0.1      │
+    └───────┴──────────┘
+    """
+    df = (
+        df.select(
+            pl.col(group_by),
+            pl.col("date").cast(pl.Date()),
+            pl.col("amount").cast(pl.Float64),
+        )
+        .drop_nulls()
+        .with_row_index("_order")
+        .sort(group_by, "_order", maintain_order=True)
+        .with_columns(
+            _t=(pl.col("date") - pl.col("date").min().over(group_by))
+            / pl.duration(days=365),
+            _group_idx=pl.col(group_by).rle_id(),
+        )
+    )
+    df_groups = df.group_by("_group_idx", maintain_order=True).agg(
+        pl.col(group_by).first(), pl.col("_order").first()
     )
-    return optimize.newton(lambda r: xnpv(r, df), guess)
+
+    t = df["_t"].to_numpy()
+    amount = df["amount"].to_numpy()
+    group_idx = df["_group_idx"].to_numpy().astype(np.intp)
+    rates = _halley_batch(
+        t, amount, group_idx, df_groups.height, guess=guess, tol=tol, maxiter=maxiter
+    )
+    failed = np.isnan(rates)
+    if failed.any():
+        rates[failed] = _bisect_batch(
+            t,
+            amount,
+            group_idx,
+            df_groups.height,
+            failed,
+            guess=guess,
+            tol=tol,
+            maxiter=maxiter,
+        )[failed]
+    return (
+        df_groups.with_columns(pl.Series("xirr", rates))
+        .sort("_order")
+        .select(pl.col(group_by), pl.col("xirr"))
+    )
+
+
+def _xirr_groups(s: pl.Series, guess: float, tol: float, maxiter: int) -> pl.Series:
+    """
+    Calculate the IRR of every group given a Series with one list of (amount, date) structs per group.
+    """
+    if not isinstance(s.dtype, pl.List):
+        # Outside of a group-by context, the whole column is a single group.
+        s = s.implode()
+    df = (
+        s.rename("cash_flows")
+        .to_frame()
+        .with_row_index("group")
+        .explode("cash_flows")
+        .unnest("cash_flows")
+    )
+    df.columns = ["group", "amount", "date"]
+    df_xirr = xirr_batch(df, group_by="group", guess=guess, tol=tol, maxiter=maxiter)
+    return (
+        pl.DataFrame({"group": pl.int_range(len(s), dtype=pl.UInt32, eager=True)})
+        .join(df_xirr, on="group", how="left", maintain_order="left")
+        .get_column("xirr")
+        # Groups without any usable cash flow are not in df_xirr, and have no solution either
+        .fill_null(float("nan"))
+        .rename(s.name)
+    )
+
+
+@pl.api.register_expr_namespace("fin")
+class FinExpr:
+    """
+    Financial expressions available as `pl.col(...).fin`.
+
+    Importing this module registers the namespace.
+    """
+
+    def __init__(self, expr: pl.Expr):
+        self._expr = expr
+
+    def xirr(
+        self,
+        date: str | pl.Expr = "date",
+        guess: float = 0.1,
+        tol: float = 1.48e-8,
+        maxiter: int = 50,
+    ) -> pl.Expr:
+        """
+        Calculate the IRR of the cash flows in this expression, dated by `date`.
+
+        In a group-by context, the cash flows of all the groups are handed over to `xirr_batch` in a single call,
+        instead of calling back into Python once per group as `map_batches(xirr, returns_scalar=True)` does. This
+        works in eager, lazy and streaming queries. Groups without a solution, including groups without any non-null
+        cash flow, get a NaN IRR.
+
+        Args:
+            date (str | pl.Expr): The date of each cash flow. Default is the 'date' column.
+            guess (float): An initial guess for the IRR of every group. Default is 0.1 (10%).
+            tol (float): Absolute tolerance on the IRR. Default matches scipy.optimize.newton.
+            maxiter (int): Maximum number of iterations for each group.
+
+        Returns:
+            pl.Expr: An expression evaluating to the IRR (Float64), one value per group.
+
+        Example:
+        >>> df = pl.DataFrame(
+        ...     {
+        ...         "scheme_code": ["A", "A", "A", "B", "B", "C"],
+        ...         "date": ["2023-01-01", "2023-02-01", "2023-03-01", "2023-01-01", "2024-01-01", "2023-01-01"],
+        ...         "amount": [1000, 1500, -3000, 1000, -1100, None],
+        ...     }
+        ... )
+        >>> df = df.with_columns(pl.col("date").cast(pl.Date()))
+        >>> df.group_by("scheme_code", maintain_order=True).agg(pl.col("amount").fin.xirr("date").alias("xirr"))
+        shape: (3, 2)
+        ┌─────────────┬──────────┐
+        │ scheme_code ┆ xirr     │
+        │ ---         ┆ ---      │
+        │ str         ┆ f64      │
+        ╞═════════════╪══════════╡
+        │ A           ┆ 4.085286 │
+        │ B           ┆ 0.1      │
+        │ C           ┆ NaN      │
+        └─────────────┴──────────┘
+        """
+        if isinstance(date, str):
+            date = pl.col(date)
+        # The amount comes first so that the result keeps the name of this expression.
+        return pl.struct(
+            self._expr.cast(pl.Float64),
+            date.cast(pl.Date()).alias("date"),
+        ).map_batches(
+            lambda s: _xirr_groups(s, guess, tol, maxiter),
+            return_dtype=pl.Float64,
+            agg_list=True,
+            returns_scalar=True,
+        )
 
 
 if __name__ == "__main__":
@@ -180,9 +674,9 @@ if __name__ == "__main__":
 
     print(xirr(df))
 
+    print(xirr_batch(df, group_by="scheme_code"))
+
     df = df.group_by("scheme_code").agg(
-        pl.struct(["date", "amount"])
-        .map_batches(xirr, returns_scalar=True)
-        .alias("xirr"),
+        pl.col("amount").fin.xirr("date").alias("xirr"),
     )
     print(df)
@@ -1,5 +1,7 @@
+import bisect
+import heapq
 import polars as pl
-from decimal import Decimal
+from collections import deque
 from dotenv import load_dotenv
 import os
 
@@ -11,30 +13,57 @@ PNL_PATH = os.environ.get("PNL_PATH")
 if not FILE_PATH or not PNL_PATH:
     raise ValueError("FILE_PATH and PNL_PATH environment variables must be set.")
 
+# Prices and amounts are handled as int64 multiples of 1e-8 rupee (micro-paise), so that matching and charges are
+# exact integer arithmetic. They are converted to Decimal only for the output.
+SCALE = 10**8
+MONEY_TYPE = pl.Decimal(38, 8)
+
+
+def to_scaled(expr):
+    """
+    Convert decimal values to int64 micro-paise.
+    """
+    return (expr.cast(MONEY_TYPE) * SCALE).cast(pl.Int64)
+
+
+def float_to_scaled(expr):
+    """
+    Convert float values (or numeric strings) to int64 micro-paise, rounded to the nearest.
+    """
+    return (expr.cast(pl.Float64) * SCALE).round().cast(pl.Int64)
+
+
+def from_scaled(expr):
+    """
+    Convert int64 micro-paise back to rupees as Decimal, exactly.
+    """
+    return (expr.cast(MONEY_TYPE) / SCALE).cast(MONEY_TYPE)
+
+
 df = pl.read_csv(FILE_PATH)
 # print(df)
 # print(df.columns)
 df = df.filter(pl.col("Trading Symbol").str.len_chars() > 0)
 
+CHARGE_COLUMNS = [
+    "Brokerage",
+    "Exchange Txn Charges",
+    "Sebi",
+    "Stamp Duty",
+    "STT",
+    "IGST",
+    "CGST",
+    "SGST",
+]
 df = df.with_columns(
-    intraday_charges=pl.sum_horizontal(
-        pl.col("Brokerage").str.to_decimal(),
-        pl.col("Exchange Txn Charges").str.to_decimal(),
-        pl.col("Sebi").str.to_decimal(),
-        pl.col("Stamp Duty").str.to_decimal(),
-        pl.col("STT").str.to_decimal(),
-        pl.col("IGST").str.to_decimal(),
-        pl.col("CGST").str.to_decimal(),
-        pl.col("SGST").str.to_decimal(),
-    ),
+    [to_scaled(pl.col(column).str.to_decimal()) for column in CHARGE_COLUMNS]
+)
+
+df = df.with_columns(
+    intraday_charges=pl.sum_horizontal(CHARGE_COLUMNS),
+    # STT is not a deductible expense for capital gains
     cg_charges=pl.sum_horizontal(
-        pl.col("Brokerage").str.to_decimal(),
-        pl.col("Exchange Txn Charges").str.to_decimal(),
-        pl.col("Sebi").str.to_decimal(),
-        pl.col("Stamp Duty").str.to_decimal(),
-        pl.col("IGST").str.to_decimal(),
-        pl.col("CGST").str.to_decimal(),
-        pl.col("SGST").str.to_decimal(),
+        [column for column in CHARGE_COLUMNS if column != "STT"]
     ),
 )
 
@@ -42,9 +71,9 @@ df = df.select(
     pl.col("Trading Symbol"),
     pl.col("Order Date").str.to_datetime().dt.date(),
     pl.col("Quantity").cast(pl.Int64),
-    pl.col("Price").str.to_decimal(),
-    pl.col("Brokerage").str.to_decimal(),
-    pl.col("STT").str.to_decimal(),
+    to_scaled(pl.col("Price").str.to_decimal()),
+    pl.col("Brokerage"),
+    pl.col("STT"),
     pl.col("intraday_charges"),
     pl.col("cg_charges"),
 )
@@ -54,30 +83,15 @@ df_sells = df.filter(pl.col("Quantity") < 0).with_columns(
     pl.col("Quantity").abs().alias("Quantity"),
 )
 
-DECIMAL_TYPE = pl.Decimal(20, 8)  # Adjust precision/scale as needed
-
+# Per unit charges are truncated to whole micro-paise (charges are never negative)
 df_buys = df_buys.with_columns(
-    (
-        pl.col("intraday_charges").cast(DECIMAL_TYPE)
-        / pl.col("Quantity").cast(DECIMAL_TYPE)
-    )
-    .alias("per_unit_intraday_charge")
-    .cast(DECIMAL_TYPE),
-    (pl.col("cg_charges").cast(DECIMAL_TYPE) / pl.col("Quantity").cast(DECIMAL_TYPE))
-    .alias("per_unit_cg_charge")
-    .cast(DECIMAL_TYPE),
+    (pl.col("intraday_charges") // pl.col("Quantity")).alias("per_unit_intraday_charge"),
+    (pl.col("cg_charges") // pl.col("Quantity")).alias("per_unit_cg_charge"),
 )
 
 df_sells = df_sells.with_columns(
-    (
-        pl.col("intraday_charges").cast(DECIMAL_TYPE)
-        / pl.col("Quantity").cast(DECIMAL_TYPE)
-    )
-    .alias("per_unit_intraday_charge")
-    .cast(DECIMAL_TYPE),
-    (pl.col("cg_charges").cast(DECIMAL_TYPE) / pl.col("Quantity").cast(DECIMAL_TYPE))
-    .alias("per_unit_cg_charge")
-    .cast(DECIMAL_TYPE),
+    (pl.col("intraday_charges") // pl.col("Quantity")).alias("per_unit_intraday_charge"),
+    (pl.col("cg_charges") // pl.col("Quantity")).alias("per_unit_cg_charge"),
 )
 
 df_pnl = pl.read_excel(
@@ -114,18 +128,86 @@ df_pnl = df_pnl.select(
     pl.col("Entry Date").str.to_date(),
     pl.col("Exit Date").str.to_date(),
     pl.col("Quantity").str.to_integer(),
-    "Buy Value",
-    "Sell Value",
+    float_to_scaled(pl.col("Buy Value")),
+    float_to_scaled(pl.col("Sell Value")),
     "Profit",
     "Turnover",
-    (pl.col("Buy Value") / pl.col("Quantity")).alias("Buy Price"),
-    (pl.col("Sell Value") / pl.col("Quantity")).alias("Sell Price"),
+)
+# Average prices, rounded to the nearest micro-paisa
+df_pnl = df_pnl.with_columns(
+    ((2 * pl.col("Buy Value") + pl.col("Quantity")) // (2 * pl.col("Quantity"))).alias(
+        "Buy Price"
+    ),
+    (
+        (2 * pl.col("Sell Value") + pl.col("Quantity")) // (2 * pl.col("Quantity"))
+    ).alias("Sell Price"),
 )
 
 # print(df_pnl)
 
 
+class BuyBucket:
+    """
+    The buys of one symbol on one date, in order, along with a queue of their positions for each price.
+
+    Buys with no quantity left are dropped lazily from the front of the order and of the price queues, so each buy is
+    passed over a bounded number of times however many sells look at the bucket.
+    """
+
+    def __init__(self):
+        self.buys = []
+        self.head = 0
+        self.queues = {}
+        self.prices = None
+
+    def add(self, buy):
+        self.queues.setdefault(buy["Price"], deque()).append(len(self.buys))
+        self.buys.append(buy)
+
+    def in_order(self):
+        """
+        Yield the buys with quantity left, in order. The caller either uses up each buy or stops iterating.
+        """
+        i = self.head
+        while i < len(self.buys):
+            buy = self.buys[i]
+            if buy["Quantity"] > 0:
+                yield buy
+            if buy["Quantity"] <= 0 and i == self.head:
+                self.head += 1
+            i += 1
+
+    def within(self, price, price_tolerance):
+        """
+        Yield the buys with quantity left and a price within price_tolerance of price, in order. The caller either
+        uses up each buy or stops iterating.
+        """
+        if self.prices is None:
+            self.prices = sorted(self.queues)
+        lo = bisect.bisect_left(self.prices, price - price_tolerance)
+        hi = bisect.bisect_right(self.prices, price + price_tolerance)
+        keys = self.prices[lo:hi]
+
+        # Merge the price queues by position to visit the buys in their original order
+        heads = []
+        for key in keys:
+            if self._front(key) is not None:
+                heapq.heappush(heads, (self._front(key), key))
+        while heads:
+            position, key = heapq.heappop(heads)
+            yield self.buys[position]
+            if self._front(key) is not None:
+                heapq.heappush(heads, (self._front(key), key))
+
+    def _front(self, key):
+        queue = self.queues[key]
+        while queue and self.buys[queue[0]]["Quantity"] <= 0:
+            queue.popleft()
+        return queue[0] if queue else None
+
+
 def allocate_buys_to_sells(df_buys, df_pnl, price_tolerance=0.01):
+    price_tolerance = round(price_tolerance * SCALE)
     df_buys = df_buys.sort(["Trading Symbol", "Order Date"])
     df_pnl = df_pnl.sort(["Symbol", "Entry Date"])
 
@@ -133,78 +215,79 @@ def allocate_buys_to_sells(df_buys, df_pnl, price_tolerance=0.01):
     sells = df_pnl.to_dicts()
     allocations = []
 
+    # Intraday and delivery sells only match buys of the same symbol and date, so buys are bucketed by both, and
+    # sells by symbol.
+    buckets = {}
+    for buy in buys:
+        key = (buy["Trading Symbol"], buy["Order Date"])
+        buckets.setdefault(key, BuyBucket()).add(buy.copy())
+    sells_by_symbol = {}
+    for sell in sells:
+        sells_by_symbol.setdefault(sell["Symbol"], []).append(sell)
+
     symbols = set([b["Trading Symbol"] for b in buys]) | set(
         [s["Symbol"] for s in sells]
     )
     for symbol in symbols:
-        buy_rows = [b.copy() for b in buys if b["Trading Symbol"] == symbol]
-        sell_rows = [s for s in sells if s["Symbol"] == symbol]
+        sell_rows = sells_by_symbol.get(symbol, [])
 
         for sell in sell_rows:
             sell_qty_left = abs(sell["Quantity"])
             is_intraday = sell["Entry Date"] == sell["Exit Date"]
 
+            bucket = buckets.get((symbol, sell["Entry Date"]))
+
             # 1. Intraday: match buys from same date, ignore price
-            if is_intraday:
-                for buy in buy_rows:
-                    if buy["Quantity"] <= 0:
-                        continue
-                    if buy["Order Date"] == sell["Entry Date"]:
-                        qty_to_allocate = min(buy["Quantity"], sell_qty_left)
-                        allocations.append(
-                            {
-                                "Symbol": symbol,
-                                "Sell Entry Date": sell["Entry Date"],
-                                "Sell Exit Date": sell["Exit Date"],
-                                "Sell Quantity": sell["Quantity"],
-                                "Buy Order Date": buy["Order Date"],
-                                "Buy Price": buy["Price"],
-                                "Sell Buy Price": sell["Buy Price"],
-                                "Sell Price": sell["Sell Price"],
-                                "Allocated Quantity": qty_to_allocate,
-                                # For intraday
-                                "Buy Charge": buy["per_unit_intraday_charge"]
-                                * Decimal(qty_to_allocate),
-                                "Charge Type": "intraday",
-                            }
-                        )
-                        buy["Quantity"] -= qty_to_allocate
-                        sell_qty_left -= qty_to_allocate
-                        if sell_qty_left == 0:
-                            break
+            if is_intraday and bucket is not None:
+                for buy in bucket.in_order():
+                    qty_to_allocate = min(buy["Quantity"], sell_qty_left)
+                    allocations.append(
+                        {
+                            "Symbol": symbol,
+                            "Sell Entry Date": sell["Entry Date"],
+                            "Sell Exit Date": sell["Exit Date"],
+                            "Sell Quantity": sell["Quantity"],
+                            "Buy Order Date": buy["Order Date"],
+                            "Buy Price": buy["Price"],
+                            "Sell Buy Price": sell["Buy Price"],
+                            "Sell Price": sell["Sell Price"],
+                            "Allocated Quantity": qty_to_allocate,
+                            # For intraday
+                            "Buy Charge": buy["per_unit_intraday_charge"]
+                            * qty_to_allocate,
+                            "Charge Type": "intraday",
+                        }
+                    )
+                    buy["Quantity"] -= qty_to_allocate
+                    sell_qty_left -= qty_to_allocate
+                    if sell_qty_left == 0:
+                        break
 
             # 2. Delivery: match on date and price
-            if not is_intraday and sell_qty_left > 0:
-                for buy in buy_rows:
-                    if buy["Quantity"] <= 0:
-                        continue
-                    if (
-                        buy["Order Date"] == sell["Entry Date"]
-                        and abs(float(buy["Price"]) - float(sell["Buy Price"]))
-                        <= price_tolerance
-                    ):
-                        qty_to_allocate = min(buy["Quantity"], sell_qty_left)
-                        allocations.append(
-                            {
-                                "Symbol": symbol,
-                                "Sell Entry Date": sell["Entry Date"],
-                                "Sell Exit Date": sell["Exit Date"],
-                                "Sell Quantity": sell["Quantity"],
-                                "Buy Order Date": buy["Order Date"],
-                                "Buy Price": buy["Price"],
-                                "Sell Buy Price": sell["Buy Price"],
-                                "Sell Price": sell["Sell Price"],
-                                "Allocated Quantity": qty_to_allocate,
-                                # For delivery
-                                "Buy Charge": buy["per_unit_cg_charge"]
-                                * Decimal(qty_to_allocate),
-                                "Charge Type": "cg",
-                            }
-                        )
-                        buy["Quantity"] -= qty_to_allocate
-                        sell_qty_left -= qty_to_allocate
-                        if sell_qty_left == 0:
-                            break
+            if not is_intraday and sell_qty_left > 0 and bucket is not None:
+                for buy in bucket.within(sell["Buy Price"], price_tolerance):
+                    qty_to_allocate = min(buy["Quantity"], sell_qty_left)
+                    allocations.append(
+                        {
+                            "Symbol": symbol,
+                            "Sell Entry Date": sell["Entry Date"],
+                            "Sell Exit Date": sell["Exit Date"],
+                            "Sell Quantity": sell["Quantity"],
+                            "Buy Order Date": buy["Order Date"],
+                            "Buy Price": buy["Price"],
+                            "Sell Buy Price": sell["Buy Price"],
+                            "Sell Price": sell["Sell Price"],
+                            "Allocated Quantity": qty_to_allocate,
+                            # For delivery
+                            "Buy Charge": buy["per_unit_cg_charge"]
+                            * qty_to_allocate,
+                            "Charge Type": "cg",
+                        }
+                    )
+                    buy["Quantity"] -= qty_to_allocate
+                    sell_qty_left -= qty_to_allocate
+                    if sell_qty_left == 0:
+                        break
 
             # 3. If still left, treat as IPO/unmatched (charge = 0)
             if sell_qty_left > 0:
@@ -219,7 +302,7 @@ def allocate_buys_to_sells(df_buys, df_pnl, price_tolerance=0.01):
                         "Sell Buy Price": sell["Buy Price"],
                         "Sell Price": sell["Sell Price"],
                         "Allocated Quantity": sell_qty_left,
-                        "Buy Charge": Decimal(0),
+                        "Buy Charge": 0,
                         "Charge Type": "intraday" if is_intraday else "cg",
                     }
                 )
@@ -231,62 +314,186 @@ df_alloc = allocate_buys_to_sells(df_buys, df_pnl)
 # print(df_alloc)
 
 
-def add_sell_charges_to_allocations(df_alloc, df_sells, price_tolerance=0.05):
-    df_sells = df_sells.with_columns(
-        pl.col("Order Date").cast(pl.Utf8), pl.col("Price").cast(pl.Float64)
-    )
-    sell_rows = df_sells.to_dicts()
-    for row in sell_rows:
-        row["_qty_left"] = row["Quantity"]
+def _attribute_sequentially(allocs, sell_rows, price_tolerance):
+    """
+    Attribute sell charges one allocation at a time, taking quantity from the matching sells in order.
 
-    allocs = df_alloc.to_dicts()
-    results = []
+    Returns:
+        dict: The Sell Charge of each allocation index, or None if the allocation could not be fully matched.
+    """
+    charges = {}
     for alloc in allocs:
-        symbol = alloc["Symbol"]
-        sell_date = str(alloc["Sell Exit Date"])
-        alloc_qty = alloc["Allocated Quantity"]
-        sell_price = float(alloc["Sell Price"])
-        is_intraday = alloc["Charge Type"] == "intraday"
-        matched = False
-
-        qty_left_to_allocate = alloc_qty
+        charge = 0
+        qty_left_to_allocate = alloc["Allocated Quantity"]
+        per_unit_charge = (
+            "per_unit_intraday_charge"
+            if alloc["Charge Type"] == "intraday"
+            else "per_unit_cg_charge"
+        )
         for sell in sell_rows:
             if (
-                sell["Trading Symbol"] == symbol
-                and str(sell["Order Date"]) == sell_date
-                and abs(float(sell["Price"]) - sell_price) <= price_tolerance
+                sell["Symbol"] == alloc["Symbol"]
+                and sell["Sell Exit Date"] == alloc["Sell Exit Date"]
+                and abs(sell["_sell_price"] - alloc["_price"]) <= price_tolerance
                 and sell["_qty_left"] > 0
             ):
                 qty_from_this_sell = min(sell["_qty_left"], qty_left_to_allocate)
-                if is_intraday:
-                    alloc.setdefault("Sell Charge", Decimal(0))
-                    alloc["Sell Charge"] += sell["per_unit_intraday_charge"] * Decimal(
-                        qty_from_this_sell
-                    )
-                else:
-                    alloc.setdefault("Sell Charge", Decimal(0))
-                    alloc["Sell Charge"] += sell["per_unit_cg_charge"] * Decimal(
-                        qty_from_this_sell
-                    )
+                charge += sell[per_unit_charge] * qty_from_this_sell
                 sell["_qty_left"] -= qty_from_this_sell
                 qty_left_to_allocate -= qty_from_this_sell
                 if qty_left_to_allocate == 0:
-                    matched = True
                     break
-        if not matched:
-            print(f"WARN: No match found for allocation: {alloc}")
-            alloc["Sell Charge"] = Decimal(0)
-        results.append(alloc)
-    return pl.DataFrame(results)
+        charges[alloc["_alloc"]] = charge if qty_left_to_allocate == 0 else None
+    return charges
+
+
+def add_sell_charges_to_allocations(df_alloc, df_sells, price_tolerance=0.05):
+    """
+    Attribute the charges of the sell trades to the allocations.
+
+    Each allocation, in order, takes its quantity from the sells of its symbol on its exit date whose price is within
+    price_tolerance of its sell price, in order, and pays their per unit charges for the quantity it takes.
+
+    Allocations with exactly the same matching sells form a pool, and within a pool this is the overlap between the
+    cumulative quantity intervals of the allocations and of the sells, computed with joins. Symbols and dates where
+    the pools share some sells (prices spread over more than the tolerance) are attributed one allocation at a time.
+
+    Returns:
+        tuple[pl.DataFrame, pl.DataFrame]: The allocations with their 'Sell Charge', and the allocations which
+            could not be fully matched, whose Sell Charge is 0.
+    """
+    price_tolerance = round(price_tolerance * SCALE)
+    df_alloc = df_alloc.with_row_index("_alloc").with_columns(
+        pl.col("Sell Price").alias("_price")
+    )
+    df_sells = df_sells.with_row_index("_sell").select(
+        pl.col("_sell"),
+        pl.col("Trading Symbol").alias("Symbol"),
+        pl.col("Order Date").alias("Sell Exit Date"),
+        pl.col("Quantity").alias("_sell_qty"),
+        pl.col("Price").alias("_sell_price"),
+        pl.col("per_unit_intraday_charge"),
+        pl.col("per_unit_cg_charge"),
+    )
+    group = ["Symbol", "Sell Exit Date"]
+
+    # Sells each allocation can take quantity from, and the pool of allocations with the same sells
+    df_pairs = (
+        df_alloc.select(
+            pl.col("_alloc"), *group, pl.col("_price"), pl.col("Allocated Quantity")
+        )
+        .join(df_sells, on=group)
+        .filter((pl.col("_sell_price") - pl.col("_price")).abs() <= price_tolerance)
+        .sort("_alloc", "_sell")
+    )
+    df_pairs = df_pairs.join(
+        df_pairs.group_by("_alloc").agg(
+            pl.col("_sell").cast(pl.String).str.join(",").alias("_pool")
+        ),
+        on="_alloc",
+    )
+    df_shared = (
+        df_pairs.filter(pl.col("_pool").n_unique().over("_sell") > 1)
+        .select(group)
+        .unique()
+    )
+    df_pairs = df_pairs.join(df_shared, on=group, how="anti")
+
+    # Cumulative quantity intervals of the allocations and the sells of each pool
+    df_alloc_intervals = (
+        df_pairs.unique("_alloc")
+        .sort("_alloc")
+        .with_columns(
+            pl.col("Allocated Quantity").cum_sum().over("_pool").alias("_alloc_end")
+        )
+        .select(
+            pl.col("_alloc"),
+            (pl.col("_alloc_end") - pl.col("Allocated Quantity")).alias("_alloc_start"),
+            pl.col("_alloc_end"),
+        )
+    )
+    df_sell_intervals = (
+        df_pairs.unique("_sell")
+        .sort("_sell")
+        .with_columns(pl.col("_sell_qty").cum_sum().over("_pool").alias("_sell_end"))
+        .select(
+            pl.col("_sell"),
+            (pl.col("_sell_end") - pl.col("_sell_qty")).alias("_sell_start"),
+            pl.col("_sell_end"),
+            pl.col("_sell_qty").sum().over("_pool").alias("_pool_qty"),
+        )
+    )
+    df_charges = (
+        df_pairs.join(df_alloc_intervals, on="_alloc")
+        .join(df_sell_intervals, on="_sell")
+        .join(df_alloc.select("_alloc", "Charge Type"), on="_alloc")
+        .with_columns(
+            (
+                pl.min_horizontal("_alloc_end", "_sell_end")
+                - pl.max_horizontal("_alloc_start", "_sell_start")
+            )
+            .clip(lower_bound=0)
+            .alias("_qty")
+        )
+        .group_by("_alloc")
+        .agg(
+            pl.when(pl.col("Charge Type") == "intraday")
+            .then(pl.col("per_unit_intraday_charge"))
+            .otherwise(pl.col("per_unit_cg_charge"))
+            .mul(pl.col("_qty"))
+            .sum()
+            .alias("Sell Charge"),
+            (pl.col("_alloc_end").first() <= pl.col("_pool_qty").first()).alias(
+                "_matched"
+            ),
+        )
+    )
+
+    # Symbols and dates with shared sells
+    sequential = _attribute_sequentially(
+        df_alloc.join(df_shared, on=group).sort("_alloc").to_dicts(),
+        df_sells.join(df_shared, on=group)
+        .sort("_sell")
+        .with_columns(pl.col("_sell_qty").alias("_qty_left"))
+        .to_dicts(),
+        price_tolerance,
+    )
+    df_sequential = pl.DataFrame(
+        {
+            "_alloc": list(sequential.keys()),
+            "Sell Charge": [charge or 0 for charge in sequential.values()],
+            "_matched": [charge is not None for charge in sequential.values()],
+        },
+        schema={"_alloc": pl.UInt32, "Sell Charge": pl.Int64, "_matched": pl.Boolean},
+    )
+
+    df_alloc = (
+        df_alloc.join(
+            pl.concat([df_charges, df_sequential]), on="_alloc", how="left"
+        )
+        .sort("_alloc")
+        .with_columns(
+            pl.when(pl.col("_matched"))
+            .then(pl.col("Sell Charge"))
+            .otherwise(0)
+            .alias("Sell Charge"),
+            pl.col("_matched").fill_null(False),
+        )
+    )
+    df_unmatched = df_alloc.filter(~pl.col("_matched")).drop(
+        "_alloc", "_price", "_matched", "Sell Charge"
+    )
+    return df_alloc.drop("_alloc", "_price", "_matched"), df_unmatched
 
 
 # Usage after your allocation:
 df_alloc = allocate_buys_to_sells(df_buys, df_pnl)
-df_alloc = add_sell_charges_to_allocations(df_alloc, df_sells).sort(
-    ["Sell Exit Date", "Buy Order Date", "Symbol"]
-)
+df_alloc, df_unmatched = add_sell_charges_to_allocations(df_alloc, df_sells)
+for alloc in df_unmatched.to_dicts():
+    print(f"WARN: No match found for allocation: {alloc}")
+df_alloc = df_alloc.sort(["Sell Exit Date", "Buy Order Date", "Symbol"])
 
-EXTRA_CG_CHARGE = Decimal("15.34")
+EXTRA_CG_CHARGE = 1534 * SCALE // 100  # Rs. 15.34
 
 df = (
     df_alloc.group_by("Symbol", "Sell Entry Date", "Sell Exit Date")
@@ -330,7 +537,7 @@ def add_extra_charge(row):
         in first_cg_set
     ):
         return EXTRA_CG_CHARGE
-    return Decimal(0)
+    return 0
 
 
 df = df.with_columns(
@@ -343,6 +550,19 @@ df = df.with_columns(
     (pl.col("Total Charges") + pl.col("Extra CG Charge")).alias("Total Charges"),
 )
 
+# Back to rupees for the output
+df = df.with_columns(
+    from_scaled(pl.col(column)).alias(column)
+    for column in [
+        "Total Buy Charge",
+        "Total Sell Charge",
+        "Total Buy Value",
+        "Total Sell Value",
+        "Total Charges",
+        "Extra CG Charge",
+    ]
+)
+
 with pl.Config(tbl_cols=20, tbl_rows=20):
     print(df)
 